@@ -0,0 +1,227 @@
+"""
+Client-side coroutines for talking to async_server.py.
+
+request_gaussian_sum is server_request from async_approach.py, but it says what it
+wants and lets the loop's sock_* methods do the waiting.
+
+download_range fetches a byte range of a file the server is serving and writes it
+to a file descriptor. Every recv lands in the same preallocated buffer (via
+sock_recv_into) and is written straight out of a memoryview of that buffer, so
+however many bytes go past, no new bytes objects are created for them.
+
+stream_gaussian_sum asks for the same sum as request_gaussian_sum, but gets the
+running total after every chunk the server computes, as an async iterator:
+
+    async with stream_gaussian_sum(10**7) as partials:
+        async for partial in partials:
+            if partial.standard_error() < 0.001:
+                break
+
+Leaving the `async with` block closes the connection, which makes the server stop
+computing the rest.
+
+Requests made inside `async with deadline(seconds):` give up once those seconds have
+passed, and tell the server how much time they have left (as "timeout=<seconds>"), so
+it stops working on them at the same time. Deadlines nest: an inner one can only
+shorten an outer one.
+
+Every function takes the server's address, which also picks the transport (TCP, a
+Unix-domain socket or an inherited socketpair; see transports.py).
+
+Usage (with async_server.py serving candy-database):
+    python async_client.py candy-database [output-path]
+    ASYNC_SERVER_ADDRESS=unix:/tmp/async_server.sock python async_client.py candy-database [output-path]
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import socket
+import sys
+import time
+import typing
+
+import eager_tasks
+import transports
+from async_server import ASYNC_SERVER_ADDRESS, STREAM_CHUNK_SIZE
+
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+
+# In loop.time(). None outside of any deadline() block.
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class ServerError(Exception):
+    pass
+
+
+@contextlib.asynccontextmanager
+async def deadline(seconds: float):
+    loop = asyncio.get_running_loop()
+    when = loop.time() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        when = min(when, outer)
+    token = _deadline.set(when)
+    try:
+        async with asyncio.timeout_at(when):
+            yield
+    finally:
+        _deadline.reset(token)
+
+
+def request_line(request: str) -> bytes:
+    """The request, plus the time left until the current deadline (if there is one), ready to send."""
+    when = _deadline.get()
+    if when is not None:
+        remaining = max(0.0, when - asyncio.get_running_loop().time())
+        request += f" timeout={remaining:.6f}"
+    return f"{request}\n".encode()
+
+
+async def connect(address=ASYNC_SERVER_ADDRESS) -> socket.socket:
+    return await transports.for_address(address).connect()
+
+
+async def read_until_closed(client: socket.socket) -> bytes:
+    loop = asyncio.get_running_loop()
+    chunks = []
+    while data := await loop.sock_recv(client, 4096):
+        chunks.append(data)
+    return b"".join(chunks)
+
+
+async def request_gaussian_sum(n_samples: int, address=ASYNC_SERVER_ADDRESS) -> float:
+    loop = asyncio.get_running_loop()
+    client = await connect(address)
+    try:
+        await loop.sock_sendall(client, request_line(f"gaussian_sum {n_samples}"))
+        response = (await read_until_closed(client)).decode()
+    finally:
+        client.close()
+    if response.startswith("ERR"):
+        raise ServerError(response[4:].strip())
+    return float(response)
+
+
+class PartialSum(typing.NamedTuple):
+    count: int
+    total: float
+
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def standard_error(self) -> float:
+        """Of mean(), as an estimate of the true mean. The samples have a standard deviation of 1."""
+        return self.count ** -0.5
+
+
+class PartialSumStream:
+    """What stream_gaussian_sum returns. Iterate over it inside `async with`, which closes the connection on the way out."""
+
+    def __init__(self, n_samples: int, chunk_size: int, address):
+        self.n_samples = n_samples
+        self.chunk_size = chunk_size
+        self.address = address
+        self._client = None
+        self._buffer = b""
+        self._done = False
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self._client = await connect(self.address)
+        await loop.sock_sendall(self._client, request_line(f"gaussian_stream {self.n_samples} {self.chunk_size}"))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        self._done = True
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> PartialSum:
+        if self._done:
+            raise StopAsyncIteration
+        loop = asyncio.get_running_loop()
+        while (newline_idx := self._buffer.find(b"\n")) == -1:
+            data = await loop.sock_recv(self._client, 4096)
+            if not data:
+                self._done = True
+                if self._buffer:
+                    raise ServerError(f"connection closed mid-line: {self._buffer!r}")
+                raise StopAsyncIteration
+            self._buffer += data
+        line, self._buffer = self._buffer[:newline_idx].decode(), self._buffer[newline_idx + 1:]
+        if line.startswith("ERR"):
+            self._done = True
+            raise ServerError(line[4:])
+        count, total = line.split()
+        return PartialSum(int(count), float(total))
+
+
+def stream_gaussian_sum(n_samples: int, chunk_size: int = STREAM_CHUNK_SIZE, address=ASYNC_SERVER_ADDRESS) -> PartialSumStream:
+    return PartialSumStream(n_samples, chunk_size, address)
+
+
+async def download_range(file_name: str, offset: int, count: int, out_fd: int, buffer: bytearray = None, address=ASYNC_SERVER_ADDRESS) -> int:
+    """Write bytes [offset, offset + count) of the server's file_name to out_fd. Returns the number of bytes written."""
+    loop = asyncio.get_running_loop()
+    buffer = buffer if buffer is not None else bytearray(RECEIVE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    client = await connect(address)
+    try:
+        await loop.sock_sendall(client, request_line(f"read {file_name} {offset} {count}"))
+
+        # The header, "<num-bytes>\n", may arrive together with the start of the payload.
+        num_buffered = 0
+        while (newline_idx := buffer.find(b"\n", 0, num_buffered)) == -1:
+            num_received = await loop.sock_recv_into(client, view[num_buffered:])
+            if not num_received:
+                raise ServerError("connection closed before the response header arrived")
+            num_buffered += num_received
+        header = bytes(view[:newline_idx]).decode()
+        if header.startswith("ERR"):
+            raise ServerError(header[4:])
+        remaining = int(header)
+        payload = view[newline_idx + 1:num_buffered]
+
+        total_written = 0
+        while True:
+            while payload:
+                num_written = os.write(out_fd, payload)
+                payload = payload[num_written:]
+                total_written += num_written
+            if total_written >= remaining:
+                return total_written
+            num_received = await loop.sock_recv_into(client, view)
+            if not num_received:
+                raise ServerError(f"connection closed after {total_written} of {remaining} bytes")
+            payload = view[:num_received]
+    finally:
+        client.close()
+
+
+async def main(file_name: str, output_path: str, address=ASYNC_SERVER_ADDRESS):
+    start_time = time.time()
+    out_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        num_bytes = await download_range(file_name, 0, 2**62, out_fd, address=address)
+    finally:
+        os.close(out_fd)
+    time_elapsed = time.time() - start_time
+    print(f"Downloaded {num_bytes:,} bytes of {file_name} in {time_elapsed:.2f}s ({num_bytes / time_elapsed / 2**20:.0f}MiB/s).")
+
+
+if __name__ == "__main__":
+    file_name = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else f"{file_name}.downloaded"
+    address = transports.parse_address(os.environ["ASYNC_SERVER_ADDRESS"]) if "ASYNC_SERVER_ADDRESS" in os.environ else ASYNC_SERVER_ADDRESS
+    eager_tasks.run(main(file_name, output_path, address))
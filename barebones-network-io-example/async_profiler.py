@@ -0,0 +1,197 @@
+"""
+A sampling profiler that understands Tasks.
+
+Point cProfile (or py-spy) at async_approach.main and you mostly see the
+event-loop's _run_once and Task.__step frames. That's accurate, but it's
+not the stack you think in. You think in terms of: main is awaiting
+uniform_sum, which is currently paused at YieldToEventLoop.
+
+This profiler runs on a background thread. Every `interval` seconds it
+looks at every live Task on the loop and rebuilds its logical await-chain:
+    1. The Task's own coroutine chain is found by following cr_await
+       (coroutine -> the coroutine or awaitable it's currently awaiting -> ...).
+    2. If a Task is blocked on another Task (Task._fut_waiter), the waiting
+       Task's chain is used as the prefix. That's how uniform_sum, which runs
+       in its own Task, ends up under main.
+    3. The one Task that's running right now has no cr_await (it's mid-step).
+       Its chain comes from the loop thread's actual Python frames instead.
+
+Each sample adds `interval` of wall-time to the stack of every live Task
+that isn't itself just waiting on another Task, and the loop thread's
+CPU-time (since the previous sample) to the running Task's stack. The results can be written as collapsed stacks, i.e. lines like
+    main;uniform_sum;YieldToEventLoop 1234
+which flamegraph.pl, speedscope or inferno all accept.
+
+The sampler only ever reads interpreter state, so it's safe to leave it
+attached to a real workload; the default 10ms interval costs well under 1%.
+
+Usage (the server must be running, just like for async_approach.py):
+    python async_profiler.py [output-prefix]
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import types
+
+
+def _awaitable_name(awaitable) -> str:
+    # A custom awaitable's __await__ is a generator; the awaitable itself
+    # is the `self` local of that generator's frame.
+    frame = getattr(awaitable, "gi_frame", None)
+    if frame is not None and frame.f_code.co_name == "__await__" and "self" in frame.f_locals:
+        return type(frame.f_locals["self"]).__name__
+    code = getattr(awaitable, "cr_code", None) or getattr(awaitable, "gi_code", None)
+    if code is not None:
+        return code.co_name
+    if type(awaitable).__name__ == "FutureIter":
+        # The C-implementation's iterator for `await some_future`.
+        return "Future"
+    return type(awaitable).__name__
+
+
+def coroutine_chain(coro) -> list[str]:
+    """Follow cr_await (or gi_yieldfrom) from coro down to the innermost awaitable."""
+    chain = []
+    while coro is not None:
+        chain.append(_awaitable_name(coro))
+        if isinstance(coro, types.CoroutineType):
+            coro = coro.cr_await
+        elif isinstance(coro, types.GeneratorType):
+            coro = coro.gi_yieldfrom
+        else:
+            break
+    return chain
+
+
+def _running_chain(task: asyncio.Task, thread_id: int) -> list[str]:
+    """The running Task has no cr_await. Walk the loop thread's frames instead."""
+    task_frame = task.get_coro().cr_frame
+    frame = sys._current_frames().get(thread_id)
+    chain = []
+    while frame is not None:
+        chain.append(frame.f_code.co_name)
+        if frame is task_frame:
+            return chain[::-1]
+        frame = frame.f_back
+    # The sample raced the Task finishing its step.
+    return [task.get_coro().cr_code.co_name]
+
+
+class AsyncSampler:
+    """Periodically samples the logical await-chain of every Task on `loop`."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.01):
+        self.loop = loop
+        self.interval = interval
+        self.wall_time = collections.Counter()
+        self.cpu_time = collections.Counter()
+        self.num_samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._loop_thread_id = None
+        self._cpu_clock_id = None
+
+    def start(self):
+        # Must be called from the loop's thread, so we know which thread to watch.
+        self._loop_thread_id = threading.get_ident()
+        if hasattr(time, "pthread_getcpuclockid"):
+            self._cpu_clock_id = time.pthread_getcpuclockid(self._loop_thread_id)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="AsyncSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _loop_cpu_time(self) -> float:
+        if self._cpu_clock_id is None:
+            # No per-thread CPU clock on this platform; fall back to the whole process.
+            return time.process_time()
+        return time.clock_gettime(self._cpu_clock_id)
+
+    def _run(self):
+        last_cpu_time = self._loop_cpu_time()
+        last_wall_time = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now_cpu_time = self._loop_cpu_time()
+            now_wall_time = time.perf_counter()
+            self._sample(now_wall_time - last_wall_time, now_cpu_time - last_cpu_time)
+            last_cpu_time, last_wall_time = now_cpu_time, now_wall_time
+
+    def _sample(self, wall_delta: float, cpu_delta: float):
+        try:
+            tasks = asyncio.all_tasks(self.loop)
+        except RuntimeError:
+            # The set of tasks changed underneath us; just skip this sample.
+            return
+        running_task = asyncio.current_task(self.loop)
+
+        own_chains = {}
+        parent_of = {}
+        for task in tasks:
+            if task is running_task:
+                own_chains[task] = _running_chain(task, self._loop_thread_id)
+            else:
+                own_chains[task] = coroutine_chain(task.get_coro())
+            waiting_on = getattr(task, "_fut_waiter", None)
+            if isinstance(waiting_on, asyncio.Task):
+                parent_of[waiting_on] = task
+
+        waiting_tasks = set(parent_of.values())
+        for task, chain in own_chains.items():
+            if task in waiting_tasks:
+                # A Task blocked on another Task is accounted for in that Task's stack.
+                continue
+            prefix = []
+            parent = parent_of.get(task)
+            seen = {task}
+            while parent is not None and parent not in seen:
+                seen.add(parent)
+                # The parent's chain ends in the awaited Task's iterator; drop that leaf.
+                prefix = own_chains.get(parent, ["?"])[:-1] + prefix
+                parent = parent_of.get(parent)
+            stack = ";".join(prefix + chain)
+            self.wall_time[stack] += wall_delta
+            if task is running_task:
+                self.cpu_time[stack] += cpu_delta
+        self.num_samples += 1
+
+    def collapsed(self, kind: str = "wall") -> str:
+        """Render the profile as collapsed stacks, weighted in microseconds."""
+        counter = self.wall_time if kind == "wall" else self.cpu_time
+        lines = [f"{stack} {int(seconds * 1e6)}" for stack, seconds in counter.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def write_collapsed(self, prefix: str):
+        for kind in ("wall", "cpu"):
+            with open(f"{prefix}.{kind}.folded", "w") as fh:
+                fh.write(self.collapsed(kind))
+
+
+if __name__ == "__main__":
+    import async_approach
+
+    output_prefix = sys.argv[1] if len(sys.argv) > 1 else "async_approach"
+
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    with AsyncSampler(event_loop) as sampler:
+        event_loop.run_until_complete(async_approach.main())
+
+    sampler.write_collapsed(output_prefix)
+    print(f"Took {sampler.num_samples} samples. Top stacks by CPU-time:")
+    for stack, seconds in sampler.cpu_time.most_common(5):
+        print(f"  {seconds:.2f}s {stack}")
+    print(f"Wrote {output_prefix}.wall.folded & {output_prefix}.cpu.folded to {os.getcwd()}.")
@@ -0,0 +1,445 @@
+"""
+An event-loop based counterpart to server.py that understands requests.
+
+server.py computes one gaussian_sum per connection, one connection at a time, and
+its clients never say anything. This server reads a one-line request first:
+    gaussian_sum <n_samples>\\n
+        Replies with the total as text, then closes. Like server.py.
+    gaussian_stream <n_samples> [<chunk_size>]\\n
+        Computes the same sum, chunk_size samples at a time, and replies with a
+        "<count> <running-total>\\n" line after every chunk. The last line has
+        count == n_samples. A client that has seen enough can just close the
+        connection: the server stops once the chunk in progress is done.
+    read <file-name> <offset> <count>\\n
+        Replies with a "<num-bytes>\\n" header, then the raw bytes of that range of
+        the file, then closes. Only files named on the command-line are served.
+Any request can also end with "timeout=<seconds>": how long the client is prepared
+to wait. Past that, the server gives up on the request and replies "ERR deadline
+exceeded\\n". If it had already started replying (e.g. part-way through a
+gaussian_stream), an ERR line would be mistaken for more of the reply, so it just
+closes the connection and the client sees a short reply instead. async_client passes
+on whatever time is left of its deadline.
+
+A malformed request (unknown command, wrong number of arguments, a number that
+isn't one) gets "ERR <what's wrong>\\n". Anything else that goes wrong is logged and
+the client only gets "ERR internal error\\n".
+
+It uses the same barebones building blocks as async_approach.py: plain non-blocking
+sockets, driven by the loop's sock_* methods. address picks the transport: a (host,
+port) for TCP, a path for a Unix-domain socket, or a transports.SocketPairTransport.
+See transports.py.
+
+File ranges are sent with loop.sock_sendfile, i.e. os.sendfile: the kernel copies the
+file's pages straight into the socket and the bytes never pass through Python. Where
+that isn't available (e.g. on Windows, or an SSL socket), it falls back to reading the
+file into a buffer, taken from a small pool of reused ones, and sending memoryview
+slices of it. Each connection has a buffer of its own, so one slow reader doesn't hold
+up everyone else's downloads.
+
+gaussian_sum is handed to a process-pool, so a long computation doesn't stop the
+server from accepting connections or streaming files meanwhile.
+
+server.py computes every answer in full, even once its client has given up waiting.
+Here, while a request is being handled, the server also watches the connection:
+if the client closes it (or the deadline passes), the handler is cancelled. A
+computation that's already running in a worker process can't be interrupted, so
+gaussian_sum is sent to the pool COMPUTE_CHUNK_SIZE samples at a time. Cancelling
+it wastes at most one chunk. A batched request that's cancelled before its batch
+is sent is left out of it.
+
+Each trip to the process-pool costs a pickle, a pipe write and a wake-up on both
+sides. With many small concurrent gaussian_sum requests, that overhead dominates. With
+batch_window set, a MicroBatcher holds requests for up to batch_window seconds (or
+until max_batch_size of them are waiting), then sends them to the pool together.
+gaussian_sums computes all of them in one pass (one vectorized draw, if NumPy is
+installed) and each connection still gets back its own, independent total. A longer
+window means bigger batches and more throughput under bursty load, but every request
+in the batch waits for it. See batching_benchmark.py.
+
+With metrics_address set, the server also serves its metrics (connections, request
+latency & outcome per command, compute time, event-loop lag and ready-queue length)
+as Prometheus text on that address. See metrics.py. Its log lines go through
+structured_log.py. Per-request lines are at DEBUG:
+    LOG_LEVEL=DEBUG LOG_FORMAT=json python async_server.py
+
+Usage:
+    python async_server.py [file-to-serve ...]
+    ASYNC_SERVER_ADDRESS=unix:/tmp/async_server.sock python async_server.py [file-to-serve ...]
+    curl http://127.0.0.1:9198/metrics
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+import eager_tasks
+import metrics
+import server
+import structured_log
+import transports
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ASYNC_SERVER_ADDRESS = ("127.0.0.1", 8198)
+MAX_REQUEST_LENGTH = 1024
+FALLBACK_CHUNK_SIZE = 256 * 1024
+# Idle fallback buffers kept for reuse. Busier moments allocate more & drop the extras afterwards.
+FALLBACK_POOL_SIZE = 4
+STREAM_CHUNK_SIZE = 250_000
+COMPUTE_CHUNK_SIZE = 250_000
+logger = logging.getLogger(__name__)
+# Above this many samples in one batch, gaussian_sums draws per request instead, to bound its memory use.
+MAX_VECTORIZED_SAMPLES = 2**23
+
+
+class RequestError(Exception):
+    pass
+
+
+class ClientDisconnected(ConnectionError):
+    pass
+
+
+# command -> (its required arguments, its optional arguments).
+COMMAND_ARGS = {
+    "gaussian_sum": (("n_samples",), ()),
+    "gaussian_stream": (("n_samples",), ("chunk_size",)),
+    "read": (("file-name", "offset", "count"), ()),
+}
+
+
+def check_arg_count(command: str, args: list[str]):
+    required, optional = COMMAND_ARGS[command]
+    if not len(required) <= len(args) <= len(required) + len(optional):
+        usage = " ".join([command, *(f"<{arg}>" for arg in required), *(f"[<{arg}>]" for arg in optional)])
+        raise RequestError(f"usage: {usage}")
+
+
+def parse_int(name: str, text: str) -> int:
+    try:
+        return int(text)
+    except ValueError:
+        raise RequestError(f"{name} must be an integer, not {text!r}") from None
+
+
+async def read_request_line(conn: socket.socket) -> str:
+    loop = asyncio.get_running_loop()
+    request = b""
+    while not request.endswith(b"\n"):
+        data = await loop.sock_recv(conn, MAX_REQUEST_LENGTH)
+        if not data:
+            raise RequestError("connection closed before a full request arrived")
+        request += data
+        if len(request) > MAX_REQUEST_LENGTH:
+            raise RequestError("request too long")
+    try:
+        return request.decode().strip()
+    except UnicodeDecodeError:
+        raise RequestError("request isn't valid UTF-8") from None
+
+
+def pop_timeout(args: list[str]) -> tuple[list[str], float]:
+    """Splits a "timeout=<seconds>" argument off a request's arguments. The timeout is None if there isn't one."""
+    timeout = None
+    remaining_args = []
+    for arg in args:
+        if arg.startswith("timeout="):
+            try:
+                timeout = max(0.0, float(arg.removeprefix("timeout=")))
+            except ValueError:
+                raise RequestError(f"timeout must be a number of seconds, not {arg.removeprefix('timeout=')!r}") from None
+        else:
+            remaining_args.append(arg)
+    return remaining_args, timeout
+
+
+async def wait_for_disconnect(conn: socket.socket):
+    """Returns once the client closes its end. Clients don't send anything after the request line."""
+    loop = asyncio.get_running_loop()
+    try:
+        while await loop.sock_recv(conn, 1024):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def send_file_range_fallback(conn: socket.socket, fh, offset: int, count: int, buffer: bytearray) -> int:
+    loop = asyncio.get_running_loop()
+    view = memoryview(buffer)
+    fh.seek(offset)
+    total_sent = 0
+    while total_sent < count:
+        num_read = fh.readinto(view[:min(len(buffer), count - total_sent)])
+        if not num_read:
+            break
+        await loop.sock_sendall(conn, view[:num_read])
+        total_sent += num_read
+    return total_sent
+
+
+def gaussian_sums(n_samples_list: list[int]) -> list[float]:
+    """server.gaussian_sum for every entry of n_samples_list, in one call."""
+    if np is None:
+        return [server.gaussian_sum(n_samples) for n_samples in n_samples_list]
+    rng = np.random.default_rng()
+    counts = np.asarray(n_samples_list, dtype=np.int64)
+    total_samples = int(counts.sum())
+    if total_samples > MAX_VECTORIZED_SAMPLES:
+        return [float(rng.standard_normal(n_samples).sum()) for n_samples in n_samples_list]
+    totals = np.zeros(len(counts))
+    nonempty = counts > 0
+    if total_samples:
+        # One draw for the whole batch. reduceat sums each request's slice of it.
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        totals[nonempty] = np.add.reduceat(rng.standard_normal(total_samples), starts)
+    return totals.tolist()
+
+
+class MicroBatcher:
+    """Collects submitted items for up to `window` seconds (or max_batch_size items), then runs fn(items) once in executor."""
+
+    def __init__(self, fn, executor, window: float, max_batch_size: int, compute_seconds: metrics.Histogram = None):
+        self.fn = fn
+        self.executor = executor
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.compute_seconds = compute_seconds
+        self.batch_sizes = []
+        # (item, future) pairs, waiting for the current batch to be flushed.
+        self._pending = []
+        self._flush_handle = None
+        self._batch_tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Leave out submitters that were cancelled (e.g. their client went away) while they waited.
+        batch = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        self.batch_sizes.append(len(batch))
+        task = asyncio.create_task(self._run_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self.executor, self.fn, [item for item, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            if self.compute_seconds is not None:
+                self.compute_seconds.observe(time.perf_counter() - start_time)
+        for (_, future), result in zip(batch, results):
+            # A submitter that was cancelled (e.g. its client went away) has a done future already.
+            if not future.done():
+                future.set_result(result)
+
+
+class AsyncServer:
+
+    def __init__(self, served_files: dict[str, str], address=ASYNC_SERVER_ADDRESS, batch_window: float = None, max_batch_size: int = 64,
+                 metrics_address=None, registry: metrics.Registry = metrics.REGISTRY):
+        self.served_files = served_files
+        self.address = address
+        self.transport = transports.for_address(address)
+        self.metrics_address = metrics_address
+        self.registry = registry
+        self.handlers = {
+            "gaussian_sum": self.handle_gaussian_sum,
+            "gaussian_stream": self.handle_gaussian_stream,
+            "read": self.handle_read,
+        }
+        # Looked up once here, so handling a request only pays for the updates themselves.
+        self._connections_total = registry.counter("connections_total", "Connections accepted.")
+        self._connections_open = registry.gauge("connections_open", "Connections currently open.")
+        self._compute_seconds = registry.histogram("compute_seconds", "From handing work to the process-pool until its result came back.")
+        self._request_seconds = {
+            command: registry.histogram("request_seconds", "From accepting a connection until it was closed.", command=command)
+            for command in (*self.handlers, "unknown")
+        }
+        # Forked workers would inherit (and so hold open) whichever connections were open at the
+        # time. The client would then never see the connection close. forkserver avoids that.
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("forkserver"))
+        # Idle buffers for send_file_range_fallback. It's rarely needed, so a few are plenty.
+        self._fallback_buffers = []
+        # Connections whose reply has started. Past that point an error can only close the connection.
+        self._replying = set()
+        self.gaussian_batcher = None
+        if batch_window is not None:
+            self.gaussian_batcher = MicroBatcher(gaussian_sums, self.process_pool, batch_window, max_batch_size, self._compute_seconds)
+
+    async def send(self, conn: socket.socket, data: bytes):
+        """loop.sock_sendall, noting that conn's reply has started. Handlers send the start of their reply through this."""
+        self._replying.add(conn)
+        await asyncio.get_running_loop().sock_sendall(conn, data)
+
+    async def send_error(self, conn: socket.socket, message: str):
+        """Reply "ERR <message>", unless the reply has started already. A client that has gone away doesn't get it."""
+        if conn in self._replying:
+            return
+        try:
+            await self.send(conn, f"ERR {message}\n".encode())
+        except ConnectionError:
+            pass
+
+    async def compute(self, fn, *args):
+        """fn(*args) in the process-pool."""
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.process_pool, fn, *args)
+        finally:
+            self._compute_seconds.observe(time.perf_counter() - start_time)
+
+    async def handle_gaussian_sum(self, conn: socket.socket, n_samples: str):
+        n_samples = parse_int("n_samples", n_samples)
+        if n_samples < 0:
+            raise RequestError("n_samples must not be negative")
+        if self.gaussian_batcher is not None:
+            total = await self.gaussian_batcher.submit(n_samples)
+        else:
+            total = 0.0
+            for chunk_start in range(0, n_samples, COMPUTE_CHUNK_SIZE):
+                this_chunk = min(COMPUTE_CHUNK_SIZE, n_samples - chunk_start)
+                total += await self.compute(server.gaussian_sum, this_chunk)
+        await self.send(conn, f"{total}".encode())
+
+    async def handle_gaussian_stream(self, conn: socket.socket, n_samples: str, chunk_size: str = STREAM_CHUNK_SIZE):
+        n_samples, chunk_size = parse_int("n_samples", n_samples), parse_int("chunk_size", chunk_size)
+        if n_samples < 0 or chunk_size <= 0:
+            raise RequestError("n_samples must not be negative and chunk_size must be positive")
+        count, total = 0, 0.0
+        while count < n_samples:
+            this_chunk = min(chunk_size, n_samples - count)
+            total += await self.compute(server.gaussian_sum, this_chunk)
+            count += this_chunk
+            await self.send(conn, f"{count} {total!r}\n".encode())
+
+    async def handle_read(self, conn: socket.socket, file_name: str, offset: str, count: str):
+        loop = asyncio.get_running_loop()
+        if file_name not in self.served_files:
+            raise RequestError(f"unknown file: {file_name}")
+        offset, count = parse_int("offset", offset), parse_int("count", count)
+        with open(self.served_files[file_name], "rb") as fh:
+            file_size = os.fstat(fh.fileno()).st_size
+            if offset < 0 or count < 0 or offset > file_size:
+                raise RequestError("byte range out of bounds")
+            count = min(count, file_size - offset)
+            await self.send(conn, f"{count}\n".encode())
+            try:
+                await loop.sock_sendfile(conn, fh, offset, count, fallback=False)
+            except asyncio.SendfileNotAvailableError:
+                buffer = self._fallback_buffers.pop() if self._fallback_buffers else bytearray(FALLBACK_CHUNK_SIZE)
+                try:
+                    await send_file_range_fallback(conn, fh, offset, count, buffer)
+                finally:
+                    if len(self._fallback_buffers) < FALLBACK_POOL_SIZE:
+                        self._fallback_buffers.append(buffer)
+
+    async def handle_connection(self, conn: socket.socket):
+        start_time = time.perf_counter()
+        self._connections_total.inc()
+        self._connections_open.inc()
+        command, outcome = "unknown", "ok"
+        try:
+            words = (await read_request_line(conn)).split()
+            if not words:
+                raise RequestError("empty request")
+            command, *args = words
+            if command not in self.handlers:
+                command, unknown_command = "unknown", command
+                raise RequestError(f"unknown command: {unknown_command}")
+            args, timeout = pop_timeout(args)
+            check_arg_count(command, args)
+            async with asyncio.timeout(timeout):
+                await self.run_until_disconnected(conn, self.handlers[command](conn, *args))
+        except RequestError as exc:
+            outcome = "bad_request"
+            await self.send_error(conn, str(exc))
+        except TimeoutError:
+            outcome = "deadline_exceeded"
+            await self.send_error(conn, "deadline exceeded")
+        except ConnectionError:
+            outcome = "disconnected"
+        except Exception:
+            # A bug, not a bad request: the details go to the log, not to the client.
+            outcome = "error"
+            logger.exception("Failed to handle %s request.", command)
+            await self.send_error(conn, "internal error")
+        finally:
+            self._replying.discard(conn)
+            conn.close()
+            time_elapsed = time.perf_counter() - start_time
+            self._connections_open.dec()
+            self._request_seconds[command].observe(time_elapsed)
+            self.registry.counter("requests_total", "Requests handled, by command & outcome.", command=command, outcome=outcome).inc()
+            structured_log.log(logger, logging.DEBUG, "Handled %s request: %s.", command, outcome, command=command, outcome=outcome, seconds=time_elapsed)
+
+    async def run_until_disconnected(self, conn: socket.socket, handler_coro):
+        handler = asyncio.create_task(handler_coro)
+        watcher = asyncio.create_task(wait_for_disconnect(conn))
+        try:
+            await asyncio.wait((handler, watcher), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Also reached when this request's deadline cancels us.
+            handler.cancel()
+            watcher.cancel()
+            await asyncio.gather(handler, watcher, return_exceptions=True)
+        if not handler.cancelled():
+            return handler.result()
+        raise ClientDisconnected()
+
+    async def serve_forever(self):
+        listener = self.transport.listen()
+        structured_log.log(logger, logging.INFO, "Server is running and listening on: %s.", self.address, address=repr(self.transport))
+
+        connection_tasks = set()
+        metrics_tasks = []
+        if self.metrics_address is not None:
+            metrics_tasks.append(asyncio.create_task(metrics.serve_metrics(self.registry, self.metrics_address)))
+            metrics_tasks.append(asyncio.create_task(metrics.monitor_loop(self.registry)))
+            structured_log.log(logger, logging.INFO, "Serving metrics on: %s.", self.metrics_address, metrics_address=self.metrics_address)
+        try:
+            while True:
+                conn = await self.transport.accept(listener)
+                task = asyncio.create_task(self.handle_connection(conn))
+                connection_tasks.add(task)
+                task.add_done_callback(connection_tasks.discard)
+        finally:
+            for task in metrics_tasks:
+                task.cancel()
+            self.transport.close(listener)
+            self.process_pool.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    structured_log.configure()
+    served_files = {os.path.basename(path): path for path in sys.argv[1:]}
+    address = transports.parse_address(os.environ["ASYNC_SERVER_ADDRESS"]) if "ASYNC_SERVER_ADDRESS" in os.environ else ASYNC_SERVER_ADDRESS
+    eager_tasks.run(AsyncServer(served_files, address, metrics_address=metrics.DEFAULT_METRICS_ADDRESS).serve_forever())
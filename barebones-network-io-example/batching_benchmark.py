@@ -0,0 +1,74 @@
+"""
+How the batch window trades latency for throughput, with AsyncServer's MicroBatcher.
+
+Every round, num_clients clients connect at once and each asks for a small
+gaussian_sum, i.e. a burst of requests where the process-pool round-trip costs more
+than the computation itself. Each round reports the requests/s of the whole burst and
+the median & p99 time a single client waited for its answer, first with batching off
+and then with increasingly long batch windows.
+
+The clients and the server share one event-loop, so the
+absolute numbers include the clients' own work. The comparison between rounds is what
+matters. With larger n_samples the computation itself dominates, and (without NumPy)
+batching stops paying for itself.
+
+Usage:
+    python batching_benchmark.py [num-clients] [n-samples]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+import eager_tasks
+from async_client import request_gaussian_sum
+from async_server import AsyncServer
+
+BENCHMARK_ADDRESS = ("127.0.0.1", 8199)
+
+
+async def timed_request(n_samples: int) -> float:
+    start_time = time.perf_counter()
+    await request_gaussian_sum(n_samples, BENCHMARK_ADDRESS)
+    return time.perf_counter() - start_time
+
+
+async def run_round(batch_window: float, num_clients: int, n_samples: int, num_bursts: int = 5):
+    async_server = AsyncServer({}, BENCHMARK_ADDRESS, batch_window=batch_window)
+    server_task = asyncio.create_task(async_server.serve_forever())
+    # Let the server start listening, and its pool start its workers.
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*(request_gaussian_sum(1, BENCHMARK_ADDRESS) for _ in range(32)))
+
+    latencies = []
+    start_time = time.perf_counter()
+    for _ in range(num_bursts):
+        latencies += await asyncio.gather(*(timed_request(n_samples) for _ in range(num_clients)))
+    time_elapsed = time.perf_counter() - start_time
+
+    server_task.cancel()
+    await asyncio.gather(server_task, return_exceptions=True)
+
+    name = "no batching" if batch_window is None else f"{batch_window * 1e3:g}ms window"
+    quantiles = statistics.quantiles(latencies, n=100)
+    line = (
+        f"{name:>14}: {len(latencies) / time_elapsed:7.0f} requests/s, "
+        f"latency p50 {quantiles[49] * 1e3:6.1f}ms, p99 {quantiles[98] * 1e3:6.1f}ms"
+    )
+    if async_server.gaussian_batcher is not None:
+        batch_sizes = async_server.gaussian_batcher.batch_sizes
+        line += f", {statistics.mean(batch_sizes):.1f} requests per batch on average"
+    print(line + ".")
+
+
+async def main(num_clients: int, n_samples: int):
+    print(f"Bursts of {num_clients} concurrent gaussian_sum({n_samples:,}) requests:")
+    for batch_window in (None, 0.0005, 0.002, 0.01):
+        await run_round(batch_window, num_clients, n_samples)
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_samples = int(float(sys.argv[2])) if len(sys.argv) > 2 else 100
+    eager_tasks.run(main(num_clients, n_samples))
@@ -0,0 +1,237 @@
+"""
+Client-side adaptive concurrency limiting, plus a per-endpoint token-bucket.
+
+async_approach.py launches server_request tasks without any limit. Start a few
+hundred of them and they all connect at once. Whatever the server can't work on
+right away waits in its listen(1024) backlog, or, with async_server.py, in its
+process-pool's queue. Throughput doesn't go up, but every request now waits behind
+all the others, so latency does.
+
+AdaptiveLimiter lets through as many requests at a time as the server can keep up
+with, and learns that number from the latencies it sees, the way TCP Vegas sizes its
+congestion window. The lowest latency seen recently (min_rtt) stands in for how long
+a request takes when nothing's queued ahead of it. With `limit` requests in flight and
+a latency of rtt, about limit * (1 - min_rtt / rtt) of them are waiting in a queue at
+the server rather than being worked on. Fewer than alpha queued: the server has room,
+so the limit goes up by one. More than beta: the limit goes down by one. A failed
+request (e.g. a refused or reset connection) cuts the limit multiplicatively.
+
+TokenBucket caps the request rate: `rate` requests per second on average, with
+bursts of up to `burst`. Each caller reserves its token up front, so waiters are
+served in order, and each sleeps only once.
+
+Endpoint ties a limiter and a bucket to one server address. Endpoint.get returns the
+same Endpoint for the same address, so every caller in the process shares them. A call
+waits for a limiter permit first and only then takes a token, so a token is spent when
+the request is actually sent. Tokens taken by requests still queued behind the limiter
+would all be spent at once when it opened up: a burst above the bucket's rate.
+
+Running this file sends bursts of gaussian_sum requests at an in-process
+AsyncServer, first unlimited, then through an Endpoint. A burst's end-to-end latency
+can't get much better: someone has to wait. With the limiter, the waiting happens at
+the client instead of the server. There, it costs the server nothing, and a caller
+can still give up or try elsewhere. Requests that do get sent come back at close to
+the server's own speed.
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+import eager_tasks
+from async_client import request_gaussian_sum
+from async_server import AsyncServer
+
+LIMITER_BENCHMARK_ADDRESS = ("127.0.0.1", 8200)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        # Allowed to go negative: that's tokens already promised to callers who are waiting for them.
+        self._tokens = float(burst)
+        self._last_refill = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._last_refill is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+        try:
+            await asyncio.sleep(-self._tokens / self.rate)
+        except asyncio.CancelledError:
+            # Hand the reserved token back.
+            self._tokens += 1
+            raise
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 1000,
+                 alpha: float = 2.0, beta: float = 4.0, min_rtt_window: int = 1000, backoff: float = 0.9):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.alpha = alpha
+        self.beta = beta
+        self.min_rtt_window = min_rtt_window
+        self.backoff = backoff
+        self.in_flight = 0
+        self.min_rtt = None
+        self.last_rtt = None
+        self._window_min_rtt = float("inf")
+        self._num_samples = 0
+        self._waiters = asyncio.Queue()
+
+    async def acquire(self):
+        if self.in_flight >= int(self.limit) or not self._waiters.empty():
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.put_nowait(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # We'd already been handed the permit. Pass it on.
+                    self.in_flight -= 1
+                    self._wake_waiters()
+                raise
+            return
+        self.in_flight += 1
+
+    def release(self, rtt: float = None, dropped: bool = False):
+        """rtt is the request's latency, if it succeeded. dropped means it failed in a way that suggests overload."""
+        was_limited = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if dropped:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif rtt is not None:
+            self._update(rtt, was_limited)
+        self._wake_waiters()
+
+    def _update(self, rtt: float, was_limited: bool):
+        self.last_rtt = rtt
+        self._num_samples += 1
+        self._window_min_rtt = min(self._window_min_rtt, rtt)
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        elif self._num_samples % self.min_rtt_window == 0:
+            # Let min_rtt move back up, e.g. if the server moved to a slower machine.
+            self.min_rtt, self._window_min_rtt = self._window_min_rtt, float("inf")
+
+        queued = self.limit * (1 - self.min_rtt / rtt)
+        if queued > self.beta:
+            self.limit = max(self.min_limit, self.limit - 1)
+        elif queued < self.alpha and was_limited:
+            # Without enough requests in flight to use the current limit, rtt says nothing about a higher one.
+            self.limit = min(self.max_limit, self.limit + 1)
+
+    def _wake_waiters(self):
+        while self.in_flight < int(self.limit) and not self._waiters.empty():
+            future = self._waiters.get_nowait()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+
+class Endpoint:
+
+    _endpoints = {}
+
+    def __init__(self, address, rate: float = 1000.0, burst: int = 100, **limiter_kwargs):
+        self.address = address
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(**limiter_kwargs)
+
+    @classmethod
+    def get(cls, address, **kwargs) -> "Endpoint":
+        """The shared Endpoint for address. kwargs only take effect for the first call per address."""
+        if address not in cls._endpoints:
+            cls._endpoints[address] = cls(address, **kwargs)
+        return cls._endpoints[address]
+
+    async def call(self, fn, *args):
+        """await fn(*args) once the limiter, and then the token-bucket, allow it."""
+        await self.limiter.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.limiter.release()
+            raise
+        start_time = time.perf_counter()
+        try:
+            result = await fn(*args)
+        except (ConnectionError, asyncio.TimeoutError):
+            self.limiter.release(dropped=True)
+            raise
+        except BaseException:
+            self.limiter.release()
+            raise
+        self.limiter.release(time.perf_counter() - start_time)
+        return result
+
+
+async def limited_server_request(n_samples: int, address=LIMITER_BENCHMARK_ADDRESS) -> float:
+    return await Endpoint.get(address).call(request_gaussian_sum, n_samples, address)
+
+
+async def run_bursts(name: str, endpoint: Endpoint, num_clients: int, n_samples: int, num_bursts: int):
+    in_flight_latencies = []
+
+    async def request():
+        # Only the request itself, not time spent waiting on the limiter.
+        start_time = time.perf_counter()
+        await request_gaussian_sum(n_samples, LIMITER_BENCHMARK_ADDRESS)
+        in_flight_latencies.append(time.perf_counter() - start_time)
+
+    async def timed_request() -> float:
+        start_time = time.perf_counter()
+        await (endpoint.call(request) if endpoint is not None else request())
+        return time.perf_counter() - start_time
+
+    latencies = []
+    start_time = time.perf_counter()
+    for _ in range(num_bursts):
+        latencies += await asyncio.gather(*(timed_request() for _ in range(num_clients)))
+    time_elapsed = time.perf_counter() - start_time
+    quantiles = statistics.quantiles(latencies, n=100)
+    in_flight_quantiles = statistics.quantiles(in_flight_latencies, n=100)
+    print(
+        f"{name:>10}: {len(latencies) / time_elapsed:4.0f} requests/s. "
+        f"End-to-end p50 {quantiles[49] * 1e3:6.1f}ms, p99 {quantiles[98] * 1e3:6.1f}ms. "
+        f"At the server p50 {in_flight_quantiles[49] * 1e3:6.1f}ms, p99 {in_flight_quantiles[98] * 1e3:6.1f}ms."
+    )
+
+
+async def main(num_clients: int, n_samples: int, num_bursts: int = 5):
+    async_server = AsyncServer({}, LIMITER_BENCHMARK_ADDRESS)
+    server_task = asyncio.create_task(async_server.serve_forever())
+    await asyncio.sleep(0.1)
+
+    print(f"Bursts of {num_clients} concurrent gaussian_sum({n_samples:,}) requests:")
+    await run_bursts("unlimited", None, num_clients, n_samples, num_bursts)
+    await run_bursts("adaptive", Endpoint.get(LIMITER_BENCHMARK_ADDRESS), num_clients, n_samples, num_bursts)
+
+    limiter = Endpoint.get(LIMITER_BENCHMARK_ADDRESS).limiter
+    print(f"The limiter settled at {limiter.limit:.0f} requests in flight. min_rtt {limiter.min_rtt * 1e3:.1f}ms, last rtt {limiter.last_rtt * 1e3:.1f}ms.")
+
+    # Shares the adaptive limit learned above. The bucket's rate spaces requests out on top of that.
+    Endpoint.get(LIMITER_BENCHMARK_ADDRESS).bucket = TokenBucket(rate=50, burst=5)
+    start_time = time.perf_counter()
+    await asyncio.gather(*(limited_server_request(n_samples) for _ in range(50)))
+    print(f"50 requests through a 50 requests/s token-bucket took {time.perf_counter() - start_time:.2f}s.")
+
+    server_task.cancel()
+    await asyncio.gather(server_task, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_samples = int(float(sys.argv[2])) if len(sys.argv) > 2 else 20_000
+    eager_tasks.run(main(num_clients, n_samples))
@@ -0,0 +1,158 @@
+"""
+An eager task-factory: new Tasks start running right away, inside create_task.
+
+hypotheses/1-creating-a-task-does-not-invoke-the-task.py shows that a new Task does
+nothing until the event-loop gets control back. The Task's first step is only put at
+the back of loop._ready. So a coroutine like basics.async_solve, or one that returns a
+cached value without ever awaiting anything, first waits behind every other ready
+handle. Its caller then suspends too, just to collect the result.
+
+With eager_task_factory installed, create_task runs the new Task's first step
+straight away, up to its first real suspension (or to the end). A coroutine that
+finishes without suspending gives back a Task that's already done, and the loop
+never schedules it at all. One that suspends carries on like any other Task.
+
+Python 3.12 has this built in, as asyncio.eager_task_factory, and that's used when
+it's there. On 3.11, the factory creates a regular (C-accelerated) Task, takes the
+step that Task just scheduled back out of loop._ready, and runs it on the spot. For
+that step, the new Task is the "current task" rather than its creator, so
+asyncio.current_task(), asyncio.timeout() etc. see the right one. Its name doesn't
+show up yet, though: on 3.11, create_task applies name= after the factory returns.
+On a loop whose _ready isn't a deque (e.g. priority_event_loop.PriorityEventLoop), it
+quietly falls back to the regular, lazy behaviour.
+
+Eager tasks change the order things happen in: the creator only continues once the
+new Task has suspended. That's why it's opt-in. The entry-points in this directory
+start their loop with run(), which turns eager tasks on when the EAGER_TASKS
+environment-variable is set (to anything other than 0):
+    EAGER_TASKS=1 python async_server.py
+
+Running this file benchmarks creating & awaiting Tasks, lazily versus eagerly. Most
+of the gain is in latency, and in throughput when each Task is awaited as soon as
+it's created. When many Tasks are created before any is awaited, the loop runs them
+all in one pass anyway, and on 3.11 this Python-level factory costs about what it
+saves. Tasks that do suspend pay a little extra for it.
+"""
+
+import asyncio
+import collections
+import os
+import statistics
+import sys
+import time
+
+
+def eager_task_factory(loop, coro, *, name=None, context=None):
+    if sys.version_info >= (3, 12):
+        return asyncio.eager_task_factory(loop, coro, name=name, context=context)
+
+    task = asyncio.Task(coro, loop=loop, name=name, context=context)
+    ready = loop._ready
+    if not (
+        asyncio.events._get_running_loop() is loop
+        and isinstance(ready, collections.deque)
+        and ready
+        and getattr(ready[-1]._callback, "__self__", None) is task
+    ):
+        return task
+
+    step = ready.pop()
+    # A Task's step refuses to run while another Task is current, so the creator steps aside for it.
+    parent = asyncio.current_task(loop)
+    if parent is not None:
+        asyncio.tasks._leave_task(loop, parent)
+    try:
+        step._run()
+    finally:
+        if parent is not None:
+            asyncio.tasks._enter_task(loop, parent)
+    return task
+
+
+def eager_tasks_requested() -> bool:
+    return os.environ.get("EAGER_TASKS", "0") not in ("", "0")
+
+
+def run(main, *, eager: bool = None):
+    """Like asyncio.run(main). With eager (or by default, the EAGER_TASKS environment-variable), Tasks start eagerly."""
+    if eager is None:
+        eager = eager_tasks_requested()
+    with asyncio.Runner() as runner:
+        if eager:
+            runner.get_loop().set_task_factory(eager_task_factory)
+        return runner.run(main)
+
+
+async def solve_cached(x: int) -> int:
+    # Like basics.async_solve when the answer's already known: it never suspends.
+    return x * 3
+
+
+async def solve_after_yield(x: int) -> int:
+    await asyncio.sleep(0)
+    return x * 3
+
+
+async def create_and_await(coro_fn, num_tasks: int) -> float:
+    start_time = time.perf_counter()
+    tasks = [asyncio.create_task(coro_fn(idx)) for idx in range(num_tasks)]
+    for task in tasks:
+        await task
+    return time.perf_counter() - start_time
+
+
+async def create_and_await_one_at_a_time(coro_fn, num_tasks: int) -> float:
+    start_time = time.perf_counter()
+    for idx in range(num_tasks):
+        await asyncio.create_task(coro_fn(idx))
+    return time.perf_counter() - start_time
+
+
+async def busy_background(stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        await asyncio.sleep(0)
+
+
+async def record_start(created_at: int, latencies: list):
+    latencies.append(time.perf_counter_ns() - created_at)
+
+
+async def start_latency(num_samples: int, num_background: int) -> list[float]:
+    """How long a new Task waits before its first line runs, with num_background other Tasks always ready."""
+    stop_event = asyncio.Event()
+    background = [asyncio.create_task(busy_background(stop_event)) for _ in range(num_background)]
+    latencies = []
+    for _ in range(num_samples):
+        await asyncio.create_task(record_start(time.perf_counter_ns(), latencies))
+    stop_event.set()
+    await asyncio.gather(*background)
+    return latencies
+
+
+async def benchmark(num_tasks: int) -> dict:
+    return {
+        "one at a time": num_tasks / await create_and_await_one_at_a_time(solve_cached, num_tasks),
+        "all at once": num_tasks / await create_and_await(solve_cached, num_tasks),
+        "suspends once": num_tasks / await create_and_await(solve_after_yield, num_tasks),
+        "start latency": await start_latency(num_samples=1000, num_background=100),
+    }
+
+
+def main(num_tasks: int):
+    print(f"Creating then awaiting {num_tasks:,} Tasks, in tasks/s:")
+    print("       never suspends, one at a time | never suspends, all at once | suspends once, all at once")
+    all_results = {eager: run(benchmark(num_tasks), eager=eager) for eager in (False, True)}
+    for eager, results in all_results.items():
+        print(
+            f"{'eager' if eager else 'lazy':>5}: {results['one at a time']:31,.0f} | "
+            f"{results['all at once']:27,.0f} | {results['suspends once']:26,.0f}"
+        )
+    print("Start latency of a new Task, i.e. from create_task to its first line, with 100 other Tasks always ready:")
+    for eager, results in all_results.items():
+        latencies = results["start latency"]
+        print(f"{'eager' if eager else 'lazy':>5}: median {statistics.median(latencies) / 1e3:7.1f}us, max {max(latencies) / 1e3:7.1f}us.")
+
+
+if __name__ == "__main__":
+    num_tasks = int(float(sys.argv[1])) if len(sys.argv) > 1 else 100_000
+    main(num_tasks)
@@ -0,0 +1,182 @@
+"""
+Hedged requests: when a replica is slow to answer, ask another one too.
+
+server_request (in async_approach.py) connects to one server and waits for however
+long that server takes. With several replicas of the server running, one of them
+may be stalled (busy, swapping, paused for a garbage-collection...), and every
+request that happens to go to it is slow. That's the tail of the latency
+distribution.
+
+HedgedClient sends each request to one replica, round-robin. If no answer has come
+back within the hedge-delay, it sends the same request to the next replica as well,
+takes whichever answer arrives first, and cancels the other. Cancelling closes that
+connection, so the server stops working on it (see async_server.py).
+
+The hedge-delay is the p95 (by default) of recent request latencies, tracked by a
+LatencyTracker. So only about 5% of requests are ever hedged: the extra load stays
+small, but those are exactly the slow ones. Until there are enough samples, it uses
+initial_hedge_delay. A primary that loses to its hedge is still recorded, as having
+taken at least the hedge-delay. A replica that fails outright (e.g. refuses the connection) is
+hedged straight away.
+
+Running this file starts three AsyncServer replicas on loopback ports, each of
+which occasionally stalls, and compares latency percentiles with & without hedging.
+Here the replicas, their process-pools and the client all share one machine, so the
+hedges' extra work also nudges up the median. Replicas on separate machines wouldn't
+feel each other's hedges like that.
+"""
+
+import asyncio
+import collections
+import itertools
+import random
+import statistics
+import sys
+import time
+
+import eager_tasks
+from async_client import request_gaussian_sum
+from async_server import AsyncServer
+
+REPLICA_ADDRESSES = [("127.0.0.1", port) for port in (8201, 8202, 8203)]
+
+
+class LatencyTracker:
+
+    def __init__(self, window: int = 1000, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, fraction: float) -> float:
+        """None until min_samples latencies have been recorded."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class HedgedClient:
+
+    def __init__(self, replicas: list, percentile: float = 0.95, initial_hedge_delay: float = 0.05):
+        if len(replicas) < 2:
+            raise ValueError("hedging needs at least two replicas")
+        self.replicas = list(replicas)
+        self.percentile = percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.tracker = LatencyTracker()
+        self._replica_idx = itertools.count()
+        self.num_requests = 0
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+
+    def hedge_delay(self) -> float:
+        delay = self.tracker.percentile(self.percentile)
+        return self.initial_hedge_delay if delay is None else delay
+
+    async def _attempt(self, fn, args, address):
+        start_time = time.perf_counter()
+        result = await fn(*args, address=address)
+        self.tracker.record(time.perf_counter() - start_time)
+        return result
+
+    async def request(self, fn, *args):
+        """await fn(*args, address=<a replica's address>), hedged. fn is e.g. async_client.request_gaussian_sum."""
+        self.num_requests += 1
+        replica_idx = next(self._replica_idx)
+        hedge_delay = self.hedge_delay()
+        start_time = time.perf_counter()
+        primary = asyncio.create_task(self._attempt(fn, args, self.replicas[replica_idx % len(self.replicas)]))
+        attempts = [primary]
+        hedge = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+            if primary in done and primary.exception() is None:
+                return primary.result()
+
+            self.num_hedges += 1
+            hedge = asyncio.create_task(self._attempt(fn, args, self.replicas[(replica_idx + 1) % len(self.replicas)]))
+            attempts.append(hedge)
+            pending = {attempt for attempt in attempts if not attempt.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        self.num_hedge_wins += attempt is hedge
+                        return attempt.result()
+            # Both failed.
+            raise hedge.exception()
+        finally:
+            if hedge is not None and not primary.done():
+                # The primary was hedged, so it had taken at least hedge_delay and would have taken
+                # longer still. Leaving it out would only ever record the fast answers, and the
+                # hedge-delay would creep down until nearly everything was hedged.
+                self.tracker.record(max(time.perf_counter() - start_time, hedge_delay))
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+
+class StallingServer(AsyncServer):
+    """An AsyncServer that, now & then, takes stall_time longer to answer."""
+
+    def __init__(self, *args, stall_probability: float, stall_time: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stall_probability = stall_probability
+        self.stall_time = stall_time
+
+    async def handle_gaussian_sum(self, conn, n_samples: str):
+        if random.random() < self.stall_probability:
+            await asyncio.sleep(self.stall_time)
+        await super().handle_gaussian_sum(conn, n_samples)
+
+
+async def run_requests(name: str, request, num_requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_request():
+        async with semaphore:
+            start_time = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start_time)
+
+    await asyncio.gather(*(timed_request() for _ in range(num_requests)))
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>10}: p50 {quantiles[49] * 1e3:6.1f}ms, p95 {quantiles[94] * 1e3:6.1f}ms, "
+        f"p99 {quantiles[98] * 1e3:6.1f}ms, max {max(latencies) * 1e3:6.1f}ms."
+    )
+
+
+async def main(num_requests: int, n_samples: int = 1_000, concurrency: int = 4):
+    replicas = [StallingServer({}, address, stall_probability=0.03, stall_time=0.1) for address in REPLICA_ADDRESSES]
+    server_tasks = [asyncio.create_task(replica.serve_forever()) for replica in replicas]
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*(request_gaussian_sum(1, address=address) for address in REPLICA_ADDRESSES for _ in range(4)))
+
+    print(f"{num_requests} gaussian_sum({n_samples:,}) requests, {concurrency} at a time, to {len(replicas)} replicas that stall 3% of the time for 100ms:")
+    replica_idx = itertools.count()
+    await run_requests(
+        "unhedged",
+        lambda: request_gaussian_sum(n_samples, address=REPLICA_ADDRESSES[next(replica_idx) % len(REPLICA_ADDRESSES)]),
+        num_requests,
+        concurrency,
+    )
+    client = HedgedClient(REPLICA_ADDRESSES)
+    await run_requests("hedged", lambda: client.request(request_gaussian_sum, n_samples), num_requests, concurrency)
+    print(
+        f"Hedged {client.num_hedges / client.num_requests:.1%} of requests (hedge-delay now {client.hedge_delay() * 1e3:.1f}ms). "
+        f"The hedge won {client.num_hedge_wins} of {client.num_hedges} times."
+    )
+
+    for server_task in server_tasks:
+        server_task.cancel()
+    await asyncio.gather(*server_tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    eager_tasks.run(main(num_requests))
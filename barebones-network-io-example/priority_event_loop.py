@@ -0,0 +1,182 @@
+"""
+An event-loop whose ready-queue respects Task priorities.
+
+In async_approach.main, server_request and uniform_sum share the event-loop's one
+ready-queue, loop._ready, which is a plain FIFO deque. When the server's response
+lands, the selector notices and server_request is put at the back of that queue,
+behind whatever uniform_sum slices are already queued. With one compute task that's
+one slice of extra latency. With twenty it's twenty.
+
+PriorityEventLoop swaps loop._ready for a queue with three classes:
+    IO      -- I/O & Future callbacks (the loop's own plumbing), and Tasks marked IO.
+    DEFAULT -- Tasks that don't say otherwise.
+    CPU     -- Tasks doing compute slices, like uniform_sum.
+The loop always runs the highest class with something ready (strict priority). To
+stop a busy IO class from starving everything below it, any handle that's been
+waiting longer than max_wait jumps the queue.
+
+Priority alone isn't enough, though. loop._run_once polls the selector, then runs
+len(loop._ready) handles before it polls again. If twenty compute slices are ready,
+a socket that becomes readable during the first one isn't even noticed until all
+twenty are done. So the queue reports a length of at most poll_every, which makes
+the loop check for I/O (with a zero timeout, since there's still work ready) at
+least every poll_every handles.
+
+A Task's class comes from PriorityTask(coro, priority=...). Tasks created with
+asyncio.create_task (or gather etc.) inside a PriorityTask inherit its priority via
+the loop's task-factory.
+
+Running this file compares I/O-completion latency, and the amount of compute done
+meanwhile, on the stock loop versus PriorityEventLoop. It doesn't need server.py;
+a thread writing to a local socketpair plays the role of the server.
+"""
+
+import asyncio
+import collections
+import socket
+import statistics
+import threading
+import time
+import random
+
+from async_approach import YieldToEventLoop
+
+IO, DEFAULT, CPU = range(3)
+
+
+class PriorityTask(asyncio.Task):
+
+    def __init__(self, coro, *, priority: int = DEFAULT, **kwargs):
+        self.priority = priority
+        super().__init__(coro, **kwargs)
+
+
+def priority_task_factory(loop, coro, context=None):
+    parent = asyncio.current_task(loop)
+    priority = getattr(parent, "priority", DEFAULT)
+    return PriorityTask(coro, priority=priority, loop=loop, context=context)
+
+
+def _priority_of(handle: asyncio.Handle) -> int:
+    # Task steps & wakeups are scheduled as callbacks bound to the Task.
+    owner = getattr(handle._callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        return getattr(owner, "priority", DEFAULT)
+    return IO
+
+
+class PriorityReadyQueue:
+    """Stands in for the deque at loop._ready. Only append, popleft, len & clear are used."""
+
+    def __init__(self, num_classes: int = 3, max_wait: float = 0.05, poll_every: int = 2):
+        self.max_wait = max_wait
+        self.poll_every = poll_every
+        self._queues = [collections.deque() for _ in range(num_classes)]
+        self._len = 0
+
+    def append(self, handle: asyncio.Handle):
+        self._queues[_priority_of(handle)].append((time.monotonic(), handle))
+        self._len += 1
+
+    def popleft(self) -> asyncio.Handle:
+        chosen = None
+        oldest_starved = None
+        now = time.monotonic()
+        for queue in self._queues:
+            if not queue:
+                continue
+            if chosen is None:
+                chosen = queue
+                continue
+            enqueued_at = queue[0][0]
+            if now - enqueued_at > self.max_wait and (oldest_starved is None or enqueued_at < oldest_starved[0][0]):
+                oldest_starved = queue
+        if chosen is None:
+            raise IndexError("pop from an empty PriorityReadyQueue")
+        self._len -= 1
+        return (oldest_starved or chosen).popleft()[1]
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self._len = 0
+
+    def __len__(self):
+        # Only _run_once asks, to decide how many handles to run before polling the selector again.
+        return min(self._len, self.poll_every)
+
+
+class PriorityEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, max_wait: float = 0.05, poll_every: int = 2):
+        super().__init__()
+        self._ready = PriorityReadyQueue(max_wait=max_wait, poll_every=poll_every)
+        self.set_task_factory(priority_task_factory)
+
+
+def peer_sending_timestamps(sock: socket.socket, num_messages: int):
+    # Plays the part of server.py: replies show up at random moments.
+    for _ in range(num_messages):
+        time.sleep(random.uniform(0.002, 0.01))
+        sock.send(time.perf_counter_ns().to_bytes(8, "little"))
+
+
+async def io_probe(sock: socket.socket, num_messages: int) -> list[float]:
+    loop = asyncio.get_running_loop()
+    latencies = []
+    buffer = b""
+    while len(latencies) < num_messages:
+        buffer += await loop.sock_recv(sock, 4096)
+        received_at = time.perf_counter_ns()
+        while len(buffer) >= 8:
+            sent_at, buffer = int.from_bytes(buffer[:8], "little"), buffer[8:]
+            latencies.append((received_at - sent_at) / 1e9)
+    return latencies
+
+
+async def cpu_worker(stop_event: asyncio.Event, slices_done: list[int]):
+    while not stop_event.is_set():
+        # A 1ms slice of compute, like one of uniform_sum's chunks.
+        deadline = time.perf_counter() + 0.001
+        while time.perf_counter() < deadline:
+            random.random()
+        slices_done[0] += 1
+        await YieldToEventLoop()
+
+
+async def run_benchmark(num_cpu_workers: int, num_messages: int):
+    ours, theirs = socket.socketpair()
+    ours.setblocking(False)
+    stop_event = asyncio.Event()
+    slices_done = [0]
+
+    workers = [PriorityTask(cpu_worker(stop_event, slices_done), priority=CPU) for _ in range(num_cpu_workers)]
+    peer = threading.Thread(target=peer_sending_timestamps, args=(theirs, num_messages))
+    start_time = time.perf_counter()
+    peer.start()
+    latencies = await PriorityTask(io_probe(ours, num_messages), priority=IO)
+    time_elapsed = time.perf_counter() - start_time
+
+    stop_event.set()
+    await asyncio.gather(*workers)
+    peer.join()
+    ours.close()
+    theirs.close()
+    return latencies, slices_done[0] / time_elapsed
+
+
+def main(num_cpu_workers: int = 20, num_messages: int = 300):
+    print(f"{num_cpu_workers} cpu-workers doing 1ms slices, while one IO task receives {num_messages} messages.")
+    for loop_cls in (asyncio.SelectorEventLoop, PriorityEventLoop):
+        loop = loop_cls()
+        latencies, slices_per_second = loop.run_until_complete(run_benchmark(num_cpu_workers, num_messages))
+        loop.close()
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"{loop_cls.__name__:>20}: I/O latency p50 {percentiles[49] * 1e3:6.2f}ms, "
+            f"p99 {percentiles[98] * 1e3:6.2f}ms. Compute kept going at {slices_per_second:.0f} slices/s."
+        )
+
+
+if __name__ == "__main__":
+    main()
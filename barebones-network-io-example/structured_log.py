@@ -0,0 +1,48 @@
+"""
+Level-gated, structured logging, in place of print.
+
+log(logger, level, message, *args, **fields) does nothing (not even format the
+message) unless the logger is enabled for that level. So per-connection lines can
+stay in the code at DEBUG and cost next to nothing when nobody's looking.
+
+configure() sets up the root logger from two environment-variables:
+    LOG_LEVEL  -- DEBUG, INFO (the default), WARNING, ...
+    LOG_FORMAT -- text (the default): just the message, on stdout, like the prints
+                  it replaces.
+                  json: one JSON object per line, with a timestamp, the level, the
+                  logger's name, the message and every one of the fields, for
+                  feeding to something that'll aggregate them.
+"""
+
+import json
+import logging
+import os
+import sys
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage().strip(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+def configure(level: str = None, log_format: str = None):
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    log_format = log_format or os.environ.get("LOG_FORMAT", "text")
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+
+
+def log(logger: logging.Logger, level: int, message: str, *args, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={"fields": fields}, stacklevel=2)
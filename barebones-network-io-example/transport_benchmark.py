@@ -0,0 +1,93 @@
+"""
+The same load on AsyncServer over each transport in transports.py.
+
+Per transport, the server serves a temporary file and answers:
+    - bursts of num_clients concurrent small reads (32 bytes each), like
+      batching_benchmark.py's bursts, but without the process-pool in the way, so
+      connection set-up and the request/response round-trip are all there is;
+    - the same small read, one request at a time: pure per-request latency;
+    - one large read, streamed to /dev/null: throughput.
+
+As in batching_benchmark.py, the clients and the server share one event-loop, so the
+absolute numbers include the clients' own work. The differences between transports
+are what matters.
+
+Usage:
+    python transport_benchmark.py [num-clients]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import eager_tasks
+import transports
+from async_client import download_range
+from async_server import AsyncServer
+
+SMALL_READ_SIZE = 32
+LARGE_READ_SIZE = 256 * 1024 * 1024
+
+
+async def small_read(address, devnull: int) -> float:
+    start_time = time.perf_counter()
+    await download_range("payload", 0, SMALL_READ_SIZE, devnull, address=address)
+    return time.perf_counter() - start_time
+
+
+async def run_transport(name: str, address, path: str, num_clients: int, num_bursts: int = 20, num_sequential: int = 2000):
+    async_server = AsyncServer({"payload": path}, address)
+    server_task = asyncio.create_task(async_server.serve_forever())
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        await asyncio.sleep(0.1)
+        await asyncio.gather(*(small_read(address, devnull) for _ in range(32)))
+
+        latencies = []
+        start_time = time.perf_counter()
+        for _ in range(num_bursts):
+            latencies += await asyncio.gather(*(small_read(address, devnull) for _ in range(num_clients)))
+        burst_rate = len(latencies) / (time.perf_counter() - start_time)
+        burst_quantiles = statistics.quantiles(latencies, n=100)
+
+        sequential = [await small_read(address, devnull) for _ in range(num_sequential)]
+
+        start_time = time.perf_counter()
+        num_bytes = await download_range("payload", 0, LARGE_READ_SIZE, devnull, address=address)
+        throughput = num_bytes / (time.perf_counter() - start_time) / 2**20
+    finally:
+        os.close(devnull)
+        server_task.cancel()
+        await asyncio.gather(server_task, return_exceptions=True)
+
+    print(
+        f"{name:>16}: {burst_rate:7,.0f} requests/s (p50 {burst_quantiles[49] * 1e3:5.1f}ms, p99 {burst_quantiles[98] * 1e3:5.1f}ms) | "
+        f"{statistics.median(sequential) * 1e6:6.0f}us | {throughput:6,.0f}MiB/s"
+    )
+
+
+async def main(num_clients: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "payload")
+        with open(path, "wb") as fh:
+            fh.truncate(LARGE_READ_SIZE)
+        candidates = {
+            "tcp": transports.TcpTransport(("127.0.0.1", 8204), nodelay=False),
+            "tcp, nodelay": ("127.0.0.1", 8205),
+            "unix": os.path.join(tmp_dir, "async_server.sock"),
+            "socketpair": transports.SocketPairTransport(),
+        }
+        print(
+            f"{'':>16}  bursts of {num_clients} concurrent {SMALL_READ_SIZE}-byte reads{'':>17} | one at a time, median | "
+            f"one {LARGE_READ_SIZE // 2**20}MiB read"
+        )
+        for name, address in candidates.items():
+            await run_transport(name, address, path, num_clients)
+
+
+if __name__ == "__main__":
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    eager_tasks.run(main(num_clients))
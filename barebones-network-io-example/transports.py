@@ -0,0 +1,254 @@
+"""
+Pluggable transports for async_server.py & async_client.py.
+
+server.SERVER_ADDRESS and async_server.ASYNC_SERVER_ADDRESS are TCP addresses on
+127.0.0.1. Every request then goes through the kernel's whole TCP stack (segments,
+checksums, acks, congestion control) just to reach another process on the same host.
+An address passed to AsyncServer or to async_client's functions can instead pick one
+of these transports:
+    ("127.0.0.1", 8198)             -- TCP, as before, with TCP_NODELAY set on both
+                                       ends, so a small reply isn't held back by
+                                       Nagle's algorithm waiting for an ack.
+    "/tmp/async_server.sock"        -- a Unix-domain stream socket at that path. Same
+                                       semantics as TCP, minus the TCP.
+    SocketPairTransport()           -- no address at all. Created before the server's
+                                       & clients' processes are started (or in the
+                                       one process that runs both), so they inherit
+                                       its control socketpair. Each connect makes a
+                                       new socketpair and passes one end to the
+                                       server over the control socket (SCM_RIGHTS).
+                                       Nothing to bind, nothing to clean up, and no
+                                       other process can connect.
+for_address turns any of those into a Transport. parse_address reads one from text,
+e.g. an environment-variable: "host:port" or "unix:<path>".
+
+Whatever the transport, the server & client only see a connected, non-blocking
+stream socket, so the request protocol and the sock_* calls don't change.
+
+See transport_benchmark.py to compare them.
+"""
+
+import abc
+import asyncio
+import errno
+import os
+import socket
+import stat
+
+
+class Transport(abc.ABC):
+
+    @abc.abstractmethod
+    def listen(self) -> socket.socket:
+        """A non-blocking socket for accept() to wait on."""
+
+    async def accept(self, listener: socket.socket) -> socket.socket:
+        """The next connection made to listener, non-blocking."""
+        loop = asyncio.get_running_loop()
+        conn, _ = await loop.sock_accept(listener)
+        conn.setblocking(False)
+        return conn
+
+    @abc.abstractmethod
+    async def connect(self) -> socket.socket:
+        """A new, non-blocking connection to the server."""
+
+    def close(self, listener: socket.socket):
+        listener.close()
+
+
+class TcpTransport(Transport):
+
+    def __init__(self, address: tuple, nodelay: bool = True):
+        self.address = address
+        self.nodelay = nodelay
+
+    def __repr__(self):
+        return f"tcp:{self.address[0]}:{self.address[1]}"
+
+    def _configure(self, sock: socket.socket):
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def listen(self) -> socket.socket:
+        listener = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(1024)
+        listener.setblocking(False)
+        return listener
+
+    async def accept(self, listener: socket.socket) -> socket.socket:
+        conn = await super().accept(listener)
+        self._configure(conn)
+        return conn
+
+    async def connect(self) -> socket.socket:
+        loop = asyncio.get_running_loop()
+        client = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        client.setblocking(False)
+        self._configure(client)
+        try:
+            await loop.sock_connect(client, self.address)
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+
+class UnixTransport(Transport):
+
+    def __init__(self, path: str):
+        self.path = path
+        # (st_dev, st_ino) of the socket file this transport bound, so close() only removes its own.
+        self._bound_file = None
+
+    def __repr__(self):
+        return f"unix:{self.path}"
+
+    def _remove_stale_socket(self):
+        """A socket file left behind by a server that didn't exit cleanly would make bind fail. One a live server still accepts on is left alone."""
+        try:
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                return
+        except FileNotFoundError:
+            return
+        probe = socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, f"a server is already listening on {self.path}")
+
+    def listen(self) -> socket.socket:
+        self._remove_stale_socket()
+        listener = socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen(1024)
+        except BaseException:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        file_stat = os.stat(self.path)
+        self._bound_file = (file_stat.st_dev, file_stat.st_ino)
+        return listener
+
+    async def connect(self) -> socket.socket:
+        loop = asyncio.get_running_loop()
+        client = socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
+        client.setblocking(False)
+        try:
+            await loop.sock_connect(client, self.path)
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+    def close(self, listener: socket.socket):
+        listener.close()
+        bound_file, self._bound_file = self._bound_file, None
+        try:
+            file_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        # Another server may have replaced the file since; that one isn't ours to remove.
+        if (file_stat.st_dev, file_stat.st_ino) == bound_file:
+            os.unlink(self.path)
+
+
+# (loop, fd, writable) -> the future every coroutine waiting on that fd shares.
+_ready_futures = {}
+
+
+async def _wait_until(sock: socket.socket, writable: bool):
+    # The loop's sock_* methods don't cover sendmsg/recvmsg, so wait for the socket directly.
+    # A loop holds one reader & one writer callback per fd: registering a second would replace
+    # the first. So all waiters on an fd share one registration, removed once it has fired.
+    loop = asyncio.get_running_loop()
+    fd = sock.fileno()
+    key = (loop, fd, writable)
+    ready = _ready_futures.get(key)
+    if ready is None:
+        add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+        ready = _ready_futures[key] = loop.create_future()
+
+        def on_ready():
+            remove(fd)
+            del _ready_futures[key]
+            if not ready.done():
+                ready.set_result(None)
+
+        add(fd, on_ready)
+    # Shielded: one waiter being cancelled mustn't cancel the others' wake-up.
+    await asyncio.shield(ready)
+
+
+class SocketPairTransport(Transport):
+    """Create it before forking/spawning the server & its clients; both ends of its control socketpair are inherited."""
+
+    def __init__(self):
+        # Datagrams, so each connect's file-descriptor arrives as its own message.
+        self.server_end, self.client_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.server_end.setblocking(False)
+        self.client_end.setblocking(False)
+
+    def __repr__(self):
+        return f"socketpair:{self.server_end.fileno()}"
+
+    def listen(self) -> socket.socket:
+        return self.server_end
+
+    async def accept(self, listener: socket.socket) -> socket.socket:
+        while True:
+            try:
+                _, fds, _, _ = socket.recv_fds(listener, 1, 1)
+            except BlockingIOError:
+                await _wait_until(listener, writable=False)
+                continue
+            if fds:
+                conn = socket.socket(fileno=fds[0])
+                conn.setblocking(False)
+                return conn
+
+    async def connect(self) -> socket.socket:
+        client, server_side = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.setblocking(False)
+            while True:
+                try:
+                    socket.send_fds(self.client_end, [b"c"], [server_side.fileno()])
+                    break
+                except BlockingIOError:
+                    # The server has a backlog of connections it hasn't accepted yet.
+                    await _wait_until(self.client_end, writable=True)
+        except BaseException:
+            client.close()
+            raise
+        finally:
+            # The server has its own copy of the file-descriptor now.
+            server_side.close()
+        return client
+
+    def close(self, listener: socket.socket):
+        # The control socketpair outlives any one server, so another can serve it later.
+        pass
+
+
+def for_address(address) -> Transport:
+    if isinstance(address, Transport):
+        return address
+    if isinstance(address, str):
+        return UnixTransport(address)
+    return TcpTransport(tuple(address))
+
+
+def parse_address(text: str):
+    """"unix:<path>" -> "<path>", "<host>:<port>" -> (host, port)."""
+    if text.startswith("unix:"):
+        return text[len("unix:"):]
+    host, _, port = text.rpartition(":")
+    return host, int(port)
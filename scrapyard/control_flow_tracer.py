@@ -0,0 +1,269 @@
+"""
+Follow the await control-flow without prints or ipdb.
+
+5-follow-the-await-control-flow.py and 6-follow-the-await-control-flow-where-one-task-sleeps.py
+figure out the order of events by stepping through the event-loop. That's great for two
+tasks, but hopeless for two thousand. This event-loop records the same events instead:
+    - Task.__step beginning & ending (and which Task it belonged to).
+    - Every other callback the loop runs (e.g. Future done-callbacks, call_later callbacks).
+    - Futures being resolved, i.e. set_result / set_exception / cancel.
+    - The time the loop spends blocked in selector.select().
+
+Events are written into a fixed-size ring buffer: one preallocated array('q') with
+4 slots per event (timestamp, event kind, object key, arg). Recording an event is
+a handful of integer stores, no tuples, dicts or strings are created. Once the buffer
+is full, the oldest events get overwritten, so it's fine to leave tracing on for a
+long run and only keep the most recent window.
+
+Tasks and callbacks are identified by a key handed out in sequence, not by id(),
+which CPython reuses once an object is gone. A Task's key is stored on the Task
+itself, so looking it up again is an attribute read. Resolved Futures all share one
+key. Names are kept only for keys that are still in the ring buffer, so that table
+stays bounded too.
+
+The trace can be exported to the Chrome trace-event JSON format. Open it in
+https://ui.perfetto.dev or chrome://tracing. Every Task gets its own row, which makes
+interleavings (and the gaps when the loop is sat in select) easy to see.
+
+Only Futures made via loop.create_future() (which asyncio.sleep & friends use) are
+seen being resolved. The C-implementation of Future can't otherwise be hooked.
+"""
+
+import array
+import asyncio
+import json
+import random
+import time
+
+STEP_BEGIN, STEP_END, TASK_DONE, CALLBACK_BEGIN, CALLBACK_END, FUTURE_DONE, SELECT_BEGIN, SELECT_END = range(8)
+FIELDS_PER_EVENT = 4
+
+
+class RingBufferTracer:
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.capacity = capacity
+        self.buffer = array.array("q", bytes(8 * FIELDS_PER_EVENT * capacity))
+        self.num_recorded = 0
+        # key -> human-readable name. Key 0 is the event-loop itself.
+        self.names = {}
+        self._next_key = 1
+        # A callback's key is per qualname: there are only as many as there are functions in the code.
+        self._callback_keys = {}
+        # Every resolved Future is recorded under this one key, so resolving one allocates nothing.
+        self.future_key = self.new_key("Future")
+
+    def new_key(self, name: str) -> int:
+        key = self._next_key
+        self._next_key += 1
+        self.names[key] = name
+        # Every event refers to one key, so at most `capacity` keys are still in the ring.
+        if len(self.names) > 2 * self.capacity:
+            self._prune_names()
+        return key
+
+    def _prune_names(self):
+        live = {self.buffer[idx + 2] for idx in range(0, len(self.buffer), FIELDS_PER_EVENT)}
+        self.names = {
+            key: name for key, name in self.names.items() if key in live or key in (self.future_key, self._next_key - 1)
+        }
+        self._callback_keys = {name: key for name, key in self._callback_keys.items() if key in self.names}
+
+    def task_key(self, task: asyncio.Task) -> int:
+        try:
+            key = task._trace_key
+        except AttributeError:
+            key = task._trace_key = self.new_key(task.get_name())
+            return key
+        if key not in self.names:
+            # Its earlier events were overwritten and its name pruned; it keeps its key (and row).
+            self.names[key] = task.get_name()
+        return key
+
+    def callback_key(self, function) -> int:
+        name = getattr(function, "__qualname__", None) or repr(function)
+        key = self._callback_keys.get(name)
+        if key is None or key not in self.names:
+            key = self._callback_keys[name] = self.new_key(name)
+        return key
+
+    def record(self, kind: int, key: int = 0, arg: int = 0):
+        idx = (self.num_recorded % self.capacity) * FIELDS_PER_EVENT
+        buffer = self.buffer
+        buffer[idx] = time.perf_counter_ns()
+        buffer[idx + 1] = kind
+        buffer[idx + 2] = key
+        buffer[idx + 3] = arg
+        self.num_recorded += 1
+
+    def events(self):
+        """Yield (timestamp_ns, kind, key, arg) from oldest to newest."""
+        first = max(0, self.num_recorded - self.capacity)
+        for event_num in range(first, self.num_recorded):
+            idx = (event_num % self.capacity) * FIELDS_PER_EVENT
+            yield tuple(self.buffer[idx:idx + FIELDS_PER_EVENT])
+
+    def to_chrome_trace(self) -> dict:
+        trace_events = []
+        # Row 0 is the event-loop itself. Each Task gets a row of its own.
+        rows = {0: 0}
+        open_spans = set()
+
+        def row_for(key: int) -> int:
+            if key not in rows:
+                rows[key] = len(rows)
+            return rows[key]
+
+        for timestamp_ns, kind, key, arg in self.events():
+            ts = timestamp_ns / 1000
+            name = self.names.get(key, f"0x{key:x}")
+            if kind in (STEP_BEGIN, STEP_END):
+                phase = "B" if kind == STEP_BEGIN else "E"
+                event = {"name": "step", "ph": phase, "ts": ts, "tid": row_for(key)}
+            elif kind in (CALLBACK_BEGIN, CALLBACK_END):
+                phase = "B" if kind == CALLBACK_BEGIN else "E"
+                event = {"name": name, "ph": phase, "ts": ts, "tid": 0}
+            elif kind in (SELECT_BEGIN, SELECT_END):
+                phase = "B" if kind == SELECT_BEGIN else "E"
+                event = {"name": "select", "ph": phase, "ts": ts, "tid": 0, "args": {"timeout_us": arg}}
+            elif kind == TASK_DONE:
+                event = {"name": "done", "ph": "i", "s": "t", "ts": ts, "tid": row_for(key)}
+            else:
+                event = {"name": f"resolved {name}", "ph": "i", "s": "t", "ts": ts, "tid": 0}
+
+            # Once the ring buffer wraps, a span's "B" may have been overwritten. Drop its "E".
+            span = (event["tid"], event["name"])
+            if event["ph"] == "B":
+                open_spans.add(span)
+            elif event["ph"] == "E":
+                if span not in open_spans:
+                    continue
+                open_spans.discard(span)
+            event["pid"] = 1
+            trace_events.append(event)
+
+        for key, row in rows.items():
+            row_name = "event-loop" if row == 0 else self.names.get(key, f"task 0x{key:x}")
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": row, "args": {"name": row_name}})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w") as fh:
+            json.dump(self.to_chrome_trace(), fh)
+
+
+class _TracedHandleMixin:
+    __slots__ = ()
+
+    def _run(self):
+        tracer = self._loop.tracer
+        callback = self._callback
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Task):
+            key = tracer.task_key(owner)
+            tracer.record(STEP_BEGIN, key)
+            super()._run()
+            tracer.record(STEP_END, key)
+            if owner.done():
+                tracer.record(TASK_DONE, key)
+        else:
+            key = tracer.callback_key(getattr(callback, "__func__", callback))
+            tracer.record(CALLBACK_BEGIN, key)
+            super()._run()
+            tracer.record(CALLBACK_END, key)
+
+
+class _TracedHandle(_TracedHandleMixin, asyncio.Handle):
+    __slots__ = ()
+
+
+class _TracedTimerHandle(_TracedHandleMixin, asyncio.TimerHandle):
+    __slots__ = ()
+
+
+class _TracedFuture(asyncio.Future):
+
+    def _record_done(self):
+        tracer = self.get_loop().tracer
+        tracer.record(FUTURE_DONE, tracer.future_key)
+
+    def set_result(self, result):
+        super().set_result(result)
+        self._record_done()
+
+    def set_exception(self, exception):
+        super().set_exception(exception)
+        self._record_done()
+
+    def cancel(self, msg=None):
+        cancelled = super().cancel(msg)
+        if cancelled:
+            self._record_done()
+        return cancelled
+
+
+class _TracedSelector:
+    """Wraps the loop's selector so time spent blocked in select() is recorded."""
+
+    def __init__(self, selector, tracer: RingBufferTracer):
+        self._selector = selector
+        self._tracer = tracer
+
+    def select(self, timeout=None):
+        timeout_us = -1 if timeout is None else int(timeout * 1e6)
+        self._tracer.record(SELECT_BEGIN, 0, timeout_us)
+        ready = self._selector.select(timeout)
+        self._tracer.record(SELECT_END, 0, len(ready))
+        return ready
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class TracingEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, capacity: int = 1 << 16):
+        super().__init__()
+        self.tracer = RingBufferTracer(capacity)
+        self._selector = _TracedSelector(self._selector, self.tracer)
+
+    # Handles are created by the base-class as usual and then re-classed in-place.
+    # The traced subclasses add no slots, so the object layout is identical.
+    def _call_soon(self, callback, args, context):
+        handle = super()._call_soon(callback, args, context)
+        handle.__class__ = _TracedHandle
+        return handle
+
+    def call_at(self, when, callback, *args, context=None):
+        timer = super().call_at(when, callback, *args, context=context)
+        timer.__class__ = _TracedTimerHandle
+        return timer
+
+    def create_future(self):
+        return _TracedFuture(loop=self)
+
+
+async def sleepy_worker(worker_idx: int):
+    for _ in range(3):
+        # A bit of cpu-work, then a bit of waiting, like 6-follow-the-await-control-flow-where-one-task-sleeps.py.
+        sum(range(random.randint(1_000, 20_000)))
+        await asyncio.sleep(random.random() / 100)
+
+
+async def main(num_workers: int):
+    tasks = [asyncio.Task(sleepy_worker(idx), name=f"sleepy_worker-{idx}") for idx in range(num_workers)]
+    for task in tasks:
+        await task
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    loop = TracingEventLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main(num_workers=200))
+    loop.close()
+
+    tracer = loop.tracer
+    print(f"Recorded {tracer.num_recorded:,} events (keeping the last {min(tracer.num_recorded, tracer.capacity):,}).")
+    tracer.write_chrome_trace("control-flow-trace.json")
+    print("Wrote control-flow-trace.json. Open it in https://ui.perfetto.dev.")
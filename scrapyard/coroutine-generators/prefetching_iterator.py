@@ -0,0 +1,202 @@
+"""
+Batched async iteration, with the next few batches fetched in the background.
+
+example-of-__anext__.py's AsyncIterable awaits fetch_data once per __anext__, i.e.
+once per item. When fetch_data goes over a socket (or reads a record from a file),
+every item pays a whole round-trip, and nothing is fetched while the consumer is
+busy with the item it already has.
+
+PrefetchingIterator fixes both:
+    - It asks its source for batch_size items at a time, via fetch_batch(batch_size),
+      so the round-trip is paid once per batch rather than once per item.
+    - A background task keeps up to prefetch batches fetched ahead of the consumer
+      (in a bounded queue; when that's full, the fetcher waits). While the consumer
+      works on one batch, the next ones are already on their way. With prefetch=0,
+      there's no background task: each batch is fetched when the last one runs out.
+fetch_batch is a coroutine-function. It returns a list of up to batch_size items, and
+an empty list once the source is exhausted. If it raises, the consumer gets that
+exception, after the batches that were fetched before it.
+
+Stopping early: breaking out of an async-for doesn't tell an iterator anything, so
+use the iterator as an async context-manager,
+    async with PrefetchingIterator(source.fetch_batch) as items:
+        async for item in items:
+            ...
+or call aclose(). Either way, the background fetch is cancelled, including a
+fetch_batch that's in flight, and nothing more is fetched.
+
+Running this file reads records from a simulated remote source, with a fixed
+latency per request, one item at a time, then in batches, then with prefetching.
+"""
+
+import asyncio
+import sys
+import time
+
+_END_OF_STREAM = object()
+
+
+class PrefetchingIterator:
+
+    def __init__(self, fetch_batch, batch_size: int = 64, prefetch: int = 2):
+        if batch_size < 1 or prefetch < 0:
+            raise ValueError("batch_size must be at least 1, and prefetch at least 0")
+        self.fetch_batch = fetch_batch
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self._batches = asyncio.Queue(maxsize=prefetch) if prefetch else None
+        self._batch = []
+        self._batch_idx = 0
+        self._fetcher = None
+        self._done = False
+
+    async def _fetch(self):
+        try:
+            while True:
+                batch = await self.fetch_batch(self.batch_size)
+                if not batch:
+                    break
+                await self._batches.put(batch)
+        except Exception as exc:
+            await self._batches.put(exc)
+            return
+        await self._batches.put(_END_OF_STREAM)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # The common case: the current batch still has items, and no await is needed.
+        if self._batch_idx < len(self._batch):
+            item = self._batch[self._batch_idx]
+            self._batch_idx += 1
+            return item
+        if self._done:
+            raise StopAsyncIteration
+        if self._batches is None:
+            batch = await self.fetch_batch(self.batch_size) or _END_OF_STREAM
+        else:
+            if self._fetcher is None:
+                self._fetcher = asyncio.create_task(self._fetch())
+            batch = await self._batches.get()
+        if batch is _END_OF_STREAM or isinstance(batch, Exception):
+            self._done = True
+            self._batch = []
+            if batch is _END_OF_STREAM:
+                raise StopAsyncIteration
+            raise batch
+        self._batch = batch
+        self._batch_idx = 1
+        return batch[0]
+
+    async def aclose(self):
+        self._done = True
+        self._batch = []
+        if self._fetcher is not None:
+            self._fetcher.cancel()
+            try:
+                await self._fetcher
+            except asyncio.CancelledError:
+                # Only swallow the fetcher's cancellation, not one aimed at whoever called aclose.
+                if asyncio.current_task().cancelling():
+                    raise
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class RemoteRecords:
+    """Stands in for a server on the other end of a socket: every request takes round_trip seconds, however many records it asks for."""
+
+    def __init__(self, num_records: int, round_trip: float):
+        self.num_records = num_records
+        self.round_trip = round_trip
+        self.next_record = 0
+        self.num_requests = 0
+
+    async def fetch_batch(self, batch_size: int) -> list:
+        self.num_requests += 1
+        await asyncio.sleep(self.round_trip)
+        start = self.next_record
+        self.next_record = min(self.num_records, start + batch_size)
+        return list(range(start, self.next_record))
+
+    async def fetch_data(self):
+        # Like example-of-__anext__.py's AsyncIterable.fetch_data: one record per request.
+        batch = await self.fetch_batch(1)
+        return batch[0] if batch else None
+
+
+class OneAtATime:
+    """example-of-__anext__.py's AsyncIterable, with a real fetch_data."""
+
+    def __init__(self, source: RemoteRecords):
+        self.source = source
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.source.fetch_data()
+        if data is not None:
+            return data
+        raise StopAsyncIteration
+
+
+async def consume(items, batch_size: int, time_per_batch: float) -> int:
+    # Every batch_size records, the consumer hands them on somewhere that takes time_per_batch.
+    total = 0
+    num_consumed = 0
+    async for record in items:
+        total += record
+        num_consumed += 1
+        if num_consumed % batch_size == 0:
+            await asyncio.sleep(time_per_batch)
+    return total
+
+
+async def stop_early(round_trip: float):
+    source = RemoteRecords(num_records=10**6, round_trip=round_trip)
+    async with PrefetchingIterator(source.fetch_batch, batch_size=100, prefetch=4) as records:
+        async for record in records:
+            if record == 150:
+                break
+    requests_then = source.num_requests
+    await asyncio.sleep(10 * round_trip)
+    print(
+        f"Stopping after 151 of 1,000,000 records made {requests_then} requests, and "
+        f"{source.num_requests - requests_then} more once the iterator was closed."
+    )
+
+
+async def main(num_records: int, batch_size: int, round_trip: float = 0.001, time_per_batch: float = 0.001):
+    print(
+        f"Reading {num_records:,} records from a source with a {round_trip * 1e3:.0f}ms round-trip, "
+        f"while spending {time_per_batch * 1e3:.0f}ms on every {batch_size} records:"
+    )
+    iterators = {
+        "one at a time": lambda source: OneAtATime(source),
+        f"batches of {batch_size}": lambda source: PrefetchingIterator(source.fetch_batch, batch_size, prefetch=0),
+        f"batches of {batch_size}, 4 prefetched": lambda source: PrefetchingIterator(source.fetch_batch, batch_size, prefetch=4),
+    }
+    for name, make_iterator in iterators.items():
+        source = RemoteRecords(num_records, round_trip)
+        start_time = time.perf_counter()
+        items = make_iterator(source)
+        try:
+            await consume(items, batch_size, time_per_batch)
+        finally:
+            if hasattr(items, "aclose"):
+                await items.aclose()
+        time_elapsed = time.perf_counter() - start_time
+        print(f"{name:>30}: {time_elapsed:6.2f}s, {num_records / time_elapsed:9,.0f} records/s, {source.num_requests:,} requests.")
+    await stop_early(round_trip)
+
+
+if __name__ == "__main__":
+    num_records = int(float(sys.argv[1])) if len(sys.argv) > 1 else 5_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(main(num_records, batch_size))
@@ -0,0 +1,228 @@
+"""
+A compact, columnar, dictionary-encoded version of candy-database.
+
+create-candy-database.py writes the same ~32-byte line over and over:
+    "Mars-Aero-Snickers-Twix-Reeses \\n"
+That's 2GiB of text carrying very little information. Each record is really just
+a handful of candy names, picked from a tiny vocabulary.
+
+convert() rewrites the file as:
+    - A header: magic, version, the number of records & columns, and the width
+      (1, 2 or 4 bytes, whichever fits the dictionary) of each token-ID.
+    - A dictionary: the distinct tokens, as a JSON list. A token's ID is its
+      position in that list. ID 0 is reserved for "this record has no token in
+      this column".
+    - One column per token-position (column 0 holds every record's first candy,
+      column 1 every record's second, ...), each stored as a packed array of IDs.
+      Columns start on 8-byte boundaries so they can be viewed in place.
+
+A 32-byte record becomes 5 bytes. CandyColumns memory-maps the file and answers
+count & filter queries directly on the packed IDs. Counting how many records have
+"Twix" in column 3 is then bytes.count over one column, with no text decoding at all.
+
+Usage:
+    python candy_columns.py [path-to-candy-database]
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"CANDYCOL"
+VERSION = 1
+# version, num_records, num_columns, id_width, dictionary length.
+HEADER = struct.Struct("<IQHBI")
+TOKEN_SEPARATOR = "-"
+ABSENT = 0
+SCAN_SIZE = 16 * 1024 * 1024
+# Token-ID width in bytes -> array typecode.
+ID_TYPECODES = {1: "B", 2: "H", 4: "I"}
+# Records per column-buffer flush while converting.
+CHUNK_RECORDS = 1 << 20
+# Distinct lines remembered while converting. candy-database only has one; a file with
+# mostly-distinct lines would otherwise grow the cache to the size of the file.
+LINE_CACHE_SIZE = 100_000
+
+
+def _id_width(num_tokens: int) -> int:
+    for width in sorted(ID_TYPECODES):
+        if num_tokens <= 1 << (8 * width):
+            return width
+    raise ValueError(f"{num_tokens:,} distinct tokens don't fit in a {max(ID_TYPECODES)}-byte token-ID.")
+
+
+def _line_ids(line: str, token_ids: dict, tokens: list, line_cache: dict) -> list:
+    ids = line_cache.get(line)
+    if ids is None:
+        ids = []
+        for token in line.strip().split(TOKEN_SEPARATOR):
+            if token not in token_ids:
+                token_ids[token] = len(tokens)
+                tokens.append(token)
+            ids.append(token_ids[token])
+        if len(line_cache) < LINE_CACHE_SIZE:
+            line_cache[line] = ids
+    return ids
+
+
+def convert(text_path: str, columns_path: str = None) -> str:
+    """Reads text_path twice: once for the dictionary & the shape, then once more to write the columns out chunk by chunk."""
+    columns_path = columns_path or text_path + ".cols"
+    tokens = [None]
+    token_ids = {}
+    # Nearly every line is identical, so cache line -> token-IDs rather than re-splitting each one.
+    line_cache = {}
+    num_records = 0
+    num_columns = 0
+
+    with open(text_path, "r") as fh:
+        for line in fh:
+            num_columns = max(num_columns, len(_line_ids(line, token_ids, tokens, line_cache)))
+            num_records += 1
+
+    id_width = _id_width(len(tokens))
+    typecode = ID_TYPECODES[id_width]
+    dictionary = json.dumps(tokens[1:]).encode()
+    position = len(MAGIC) + HEADER.size + len(dictionary)
+    column_offsets = []
+    for _ in range(num_columns):
+        position += -position % 8
+        column_offsets.append(position)
+        position += num_records * id_width
+
+    with open(columns_path, "wb") as out:
+        out.write(MAGIC)
+        out.write(HEADER.pack(VERSION, num_records, num_columns, id_width, len(dictionary)))
+        out.write(dictionary)
+        out.truncate(position)
+        out_fd = out.fileno()
+
+        buffers = [array.array(typecode) for _ in range(num_columns)]
+        num_flushed = 0
+
+        def flush():
+            for column_offset, buffer in zip(column_offsets, buffers):
+                os.pwrite(out_fd, buffer.tobytes(), column_offset + num_flushed * id_width)
+                del buffer[:]
+
+        with open(text_path, "r") as fh:
+            for record_idx, line in enumerate(fh):
+                ids = _line_ids(line, token_ids, tokens, line_cache)
+                for column_idx, buffer in enumerate(buffers):
+                    buffer.append(ids[column_idx] if column_idx < len(ids) else ABSENT)
+                if len(buffers[0]) == CHUNK_RECORDS:
+                    flush()
+                    num_flushed = record_idx + 1
+        flush()
+    return columns_path
+
+
+class CandyColumns:
+
+    def __init__(self, path: str):
+        self._fh = open(path, "rb")
+        self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} isn't a candy-columns file.")
+        version, self.num_records, num_columns, self.id_width, dictionary_length = HEADER.unpack_from(self._mmap, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"Unsupported candy-columns version: {version}.")
+        if self.id_width not in ID_TYPECODES:
+            raise ValueError(f"Unsupported token-ID width: {self.id_width}.")
+        self._typecode = ID_TYPECODES[self.id_width]
+
+        position = len(MAGIC) + HEADER.size
+        self.tokens = [None] + json.loads(self._mmap[position:position + dictionary_length])
+        self.token_ids = {token: token_id for token_id, token in enumerate(self.tokens) if token is not None}
+        position += dictionary_length
+
+        view = memoryview(self._mmap)
+        column_size = self.num_records * self.id_width
+        self.column_offsets = []
+        self.columns = []
+        for _ in range(num_columns):
+            position += -position % 8
+            column = view[position:position + column_size]
+            self.column_offsets.append(position)
+            self.columns.append(column if self.id_width == 1 else column.cast(self._typecode))
+            position += column_size
+
+    def count(self, column_idx: int, token: str) -> int:
+        """How many records have `token` in column column_idx."""
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            return 0
+        if np is not None:
+            return int(np.count_nonzero(self._as_numpy(column_idx) == token_id))
+        if self.id_width == 1:
+            # bytes.count, a slice of the column at a time so we never hold a full copy.
+            start = self.column_offsets[column_idx]
+            stop = start + self.num_records
+            needle = bytes([token_id])
+            return sum(self._mmap[idx:min(idx + SCAN_SIZE, stop)].count(needle) for idx in range(start, stop, SCAN_SIZE))
+        return array.array(self._typecode, self.columns[column_idx]).count(token_id)
+
+    def filter(self, column_idx: int, token: str):
+        """Yield the index of every record with `token` in column column_idx."""
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            return
+        if np is not None:
+            yield from np.flatnonzero(self._as_numpy(column_idx) == token_id).tolist()
+        elif self.id_width == 1:
+            start = self.column_offsets[column_idx]
+            stop = start + self.num_records
+            needle = bytes([token_id])
+            position = self._mmap.find(needle, start, stop)
+            while position != -1:
+                yield position - start
+                position = self._mmap.find(needle, position + 1, stop)
+        else:
+            for record_idx, value in enumerate(self.columns[column_idx]):
+                if value == token_id:
+                    yield record_idx
+
+    def _as_numpy(self, column_idx: int):
+        dtype = {1: np.uint8, 2: np.uint16, 4: np.uint32}[self.id_width]
+        return np.frombuffer(self._mmap, dtype=dtype, count=self.num_records, offset=self.column_offsets[column_idx])
+
+    def record(self, record_idx: int) -> str:
+        tokens = [self.tokens[column[record_idx]] for column in self.columns]
+        return TOKEN_SEPARATOR.join(token for token in tokens if token is not None)
+
+    def close(self):
+        for column in self.columns:
+            column.release()
+        self._mmap.close()
+        self._fh.close()
+
+
+if __name__ == "__main__":
+    text_path = sys.argv[1] if len(sys.argv) > 1 else "candy-database"
+
+    start_time = time.time()
+    columns_path = convert(text_path)
+    print(f"Converting {text_path} took: {time.time() - start_time:.2f}s.")
+    text_size, columns_size = os.path.getsize(text_path), os.path.getsize(columns_path)
+    print(f"{text_size:,} bytes of text became {columns_size:,} bytes ({text_size / columns_size:.1f}x smaller).")
+
+    start_time = time.time()
+    with open(text_path, "rb") as fh:
+        text_count = sum(1 for line in fh if line.split(b"-")[3:4] == [b"Twix"])
+    print(f"Counting Twix-in-4th-place by scanning the text took: {time.time() - start_time:.2f}s. count: {text_count:,}.")
+
+    candy_columns = CandyColumns(columns_path)
+    start_time = time.time()
+    columns_count = candy_columns.count(3, "Twix")
+    print(f"Counting it on the columns took: {time.time() - start_time:.2f}s. count: {columns_count:,}.")
+    print(f"The first record decodes back to: {candy_columns.record(0)!r}.")
+    candy_columns.close()
@@ -0,0 +1,230 @@
+"""
+A small selector layer: epoll on Linux, with edge-triggering and batched changes.
+
+use_select.py used to hard-code selectors.KqueueSelector (what DefaultSelector picks
+on a Mac), which doesn't exist on Linux, and to register a regular file, which kqueue
+always reports as ready (see non-blocking-read.py) and epoll won't watch at all. It
+now reads through a pipe, with the selector from make_selector().
+
+make_selector() returns an EpollEventSelector on Linux and a DefaultSelectorAdapter
+elsewhere. Both have the same interface:
+    register(fd, events, data=None, edge_triggered=False)
+    modify(fd, events, data=None)
+    unregister(fd)
+    select(timeout=None) -> [(fd, ready_events, data), ...]
+
+Level-triggered (the default, and what selectors/asyncio use): select keeps
+reporting an fd for as long as it's ready, e.g. while there's unread data.
+Edge-triggered: select reports an fd once each time it *becomes* ready. You have to
+drain it (read until BlockingIOError) before it'll be reported again, but an fd that
+you've chosen to leave unread doesn't come back on every single select call.
+
+Every register/modify/unregister is a separate epoll_ctl syscall. Code that re-arms
+interest often (e.g. toggling EVENT_WRITE on & off around each send) pays for that.
+EpollEventSelector queues modify()s up and applies them right before the next
+epoll_wait, coalescing repeated changes to the same fd into at most one syscall (and
+none at all when they cancel out). register and unregister go to the kernel straight
+away: register so that an fd epoll can't watch (a closed one, a regular file...)
+fails right there, and unregister because the caller is free to close the fd next,
+and the number can then be reused by a new fd that has to be registered afresh.
+
+Edge-triggering isn't available through the fallback adapter; asking for it raises
+ValueError.
+
+Running this file benchmarks the cost of one select-loop iteration with 10k idle
+and 100 active socketpairs, with and without re-arming each active fd's interest.
+"""
+
+import resource
+import select
+import selectors
+import socket
+import sys
+import time
+
+EVENT_READ = selectors.EVENT_READ
+EVENT_WRITE = selectors.EVENT_WRITE
+
+
+def _to_epoll_mask(events: int, edge_triggered: bool) -> int:
+    mask = 0
+    if events & EVENT_READ:
+        mask |= select.EPOLLIN
+    if events & EVENT_WRITE:
+        mask |= select.EPOLLOUT
+    if edge_triggered:
+        mask |= select.EPOLLET
+    return mask
+
+
+class EpollEventSelector:
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        # fd -> (events, data, edge_triggered), as the caller currently sees it.
+        self._registered = {}
+        # fd -> the epoll-mask the kernel currently has. Absent if the kernel doesn't know the fd yet.
+        self._in_kernel = {}
+        self._pending = set()
+
+    def register(self, fd: int, events: int, data=None, edge_triggered: bool = False):
+        if fd in self._registered:
+            raise KeyError(f"{fd} is already registered")
+        mask = _to_epoll_mask(events, edge_triggered)
+        self._epoll.register(fd, mask)
+        self._in_kernel[fd] = mask
+        self._registered[fd] = (events, data, edge_triggered)
+
+    def modify(self, fd: int, events: int, data=None):
+        _, _, edge_triggered = self._registered[fd]
+        self._registered[fd] = (events, data, edge_triggered)
+        self._pending.add(fd)
+
+    def unregister(self, fd: int):
+        del self._registered[fd]
+        self._pending.discard(fd)
+        del self._in_kernel[fd]
+        try:
+            self._epoll.unregister(fd)
+        except OSError:
+            # The fd was already closed, and closing it dropped it from the epoll set.
+            pass
+
+    def _apply_pending(self):
+        pending, self._pending = self._pending, set()
+        failed = []
+        for fd in pending:
+            events, _, edge_triggered = self._registered[fd]
+            mask = _to_epoll_mask(events, edge_triggered)
+            if self._in_kernel[fd] == mask:
+                continue
+            try:
+                self._epoll.modify(fd, mask)
+            except OSError as exc:
+                # E.g. the fd was closed without being unregistered first. Forget it, so only this select raises.
+                failed.append((fd, exc))
+                continue
+            self._in_kernel[fd] = mask
+        for fd, _ in failed:
+            del self._registered[fd]
+            del self._in_kernel[fd]
+        if failed:
+            fd, exc = failed[0]
+            raise OSError(exc.errno, f"modify of fd {fd} failed: {exc.strerror}; it is no longer registered")
+
+    def select(self, timeout: float = None) -> list:
+        if self._pending:
+            self._apply_pending()
+        ready = []
+        for fd, mask in self._epoll.poll(-1 if timeout is None else timeout, max(len(self._registered), 1)):
+            registered = self._registered.get(fd)
+            if registered is None:
+                continue
+            events = 0
+            if mask & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                events |= EVENT_READ
+            if mask & (select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR):
+                events |= EVENT_WRITE
+            events &= registered[0]
+            if events:
+                ready.append((fd, events, registered[1]))
+        return ready
+
+    def close(self):
+        self._epoll.close()
+
+
+class DefaultSelectorAdapter:
+    """The same interface over selectors.DefaultSelector, for platforms without epoll."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, fd: int, events: int, data=None, edge_triggered: bool = False):
+        if edge_triggered:
+            raise ValueError(f"{type(self._selector).__name__} doesn't support edge-triggered registration")
+        self._selector.register(fd, events, data)
+
+    def modify(self, fd: int, events: int, data=None):
+        self._selector.modify(fd, events, data)
+
+    def unregister(self, fd: int):
+        self._selector.unregister(fd)
+
+    def select(self, timeout: float = None) -> list:
+        return [(key.fd, events, key.data) for key, events in self._selector.select(timeout)]
+
+    def close(self):
+        self._selector.close()
+
+
+def make_selector():
+    if hasattr(select, "epoll"):
+        return EpollEventSelector()
+    return DefaultSelectorAdapter()
+
+
+def make_socketpairs(num_pairs: int) -> list[tuple[socket.socket, socket.socket]]:
+    pairs = [socket.socketpair() for _ in range(num_pairs)]
+    for ours, _ in pairs:
+        ours.setblocking(False)
+    return pairs
+
+
+def run_benchmark(name: str, selector, idle_pairs, active_pairs, num_iterations: int, edge_triggered: bool = False, rearm: bool = False) -> float:
+    for ours, _ in idle_pairs + active_pairs:
+        selector.register(ours.fileno(), EVENT_READ, ours, edge_triggered=edge_triggered)
+
+    start_time = time.perf_counter()
+    for _ in range(num_iterations):
+        for ours, theirs in active_pairs:
+            theirs.send(b"x")
+            if rearm:
+                # Like a send that briefly wanted EVENT_WRITE, then didn't need it after all.
+                selector.modify(ours.fileno(), EVENT_READ | EVENT_WRITE, ours)
+                selector.modify(ours.fileno(), EVENT_READ, ours)
+        num_ready = 0
+        while num_ready < len(active_pairs):
+            for fd, events, sock in selector.select(timeout=1):
+                sock.recv(4096)
+                num_ready += 1
+    time_per_iteration = (time.perf_counter() - start_time) / num_iterations
+
+    for ours, _ in idle_pairs + active_pairs:
+        selector.unregister(ours.fileno())
+    selector.close()
+    print(f"{name:>36}: {time_per_iteration * 1e6:8.0f}us per select-loop iteration.")
+    return time_per_iteration
+
+
+class _StdlibAdapter(DefaultSelectorAdapter):
+    def __init__(self, selector_cls):
+        self._selector = selector_cls()
+
+
+def main(num_idle: int, num_active: int, num_iterations: int):
+    # Each socketpair is two fds. Raise the open-file limit as far as we're allowed.
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    num_idle = min(num_idle, (hard_limit - 2 * num_active - 100) // 2)
+
+    idle_pairs = make_socketpairs(num_idle)
+    active_pairs = make_socketpairs(num_active)
+    print(f"{num_idle:,} idle & {num_active} active socketpairs, {num_iterations} iterations each.")
+
+    for rearm in (False, True):
+        print("Each active fd's interest is re-armed every iteration:" if rearm else "Reading only:")
+        run_benchmark("selectors.PollSelector", _StdlibAdapter(selectors.PollSelector), idle_pairs, active_pairs, num_iterations, rearm=rearm)
+        if hasattr(select, "epoll"):
+            run_benchmark("selectors.EpollSelector", _StdlibAdapter(selectors.EpollSelector), idle_pairs, active_pairs, num_iterations, rearm=rearm)
+            run_benchmark("EpollEventSelector (level-triggered)", EpollEventSelector(), idle_pairs, active_pairs, num_iterations, rearm=rearm)
+            run_benchmark("EpollEventSelector (edge-triggered)", EpollEventSelector(), idle_pairs, active_pairs, num_iterations, edge_triggered=True, rearm=rearm)
+
+    for ours, theirs in idle_pairs + active_pairs:
+        ours.close()
+        theirs.close()
+
+
+if __name__ == "__main__":
+    num_idle = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    main(num_idle=num_idle, num_active=100, num_iterations=200)
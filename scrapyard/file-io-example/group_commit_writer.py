@@ -0,0 +1,290 @@
+"""
+An async, buffered, group-committing appender.
+
+create-candy-database.py writes its file with a tiny fh.write per 32-byte record.
+Inside an event-loop, each of those writes blocks the loop, however briefly, and a
+write that has to be durable (i.e. followed by an fsync) blocks it for as long as the
+disk takes, which can be milliseconds. With many coroutines appending records, the
+loop spends most of its time stuck in the kernel.
+
+GroupCommitWriter takes the I/O off the loop:
+    - write(data) only appends to an in-memory buffer. It never blocks, and never
+      awaits. Once a buffer reaches buffer_size, it's sealed and a new one started, so
+      what gets written is a few large buffers rather than many small ones. Data at
+      least that big skips the copy and goes out as-is.
+    - A committer task hands the sealed buffers to a background thread, which writes
+      them all with one os.writev (or as few as IOV_MAX allows), then fsyncs.
+    - Group commit: the committer waits up to fsync_interval for more writes to join
+      a commit (less, if the buffers fill up first). While one commit is running on the
+      thread, the next one's writes pile up. So one fsync covers every write made
+      while the previous one ran, and many writers share its cost.
+    - await writer.sync() returns once everything written before it is on disk, i.e.
+      has been fsynced. Callers that need durability await it; the rest don't.
+    - await writer.drain() waits for the writer to catch up when more than
+      max_buffered bytes haven't been written yet, like asyncio.StreamWriter.drain.
+If a write or fsync fails, the waiting sync() calls, and every later call, raise it.
+
+Running this file has many coroutines each append records and wait for them to be
+durable: with a write & fsync per record on the event-loop, with those in a thread
+per record, and with a GroupCommitWriter (awaiting sync() per record, then only once
+at the end). It also reports how late a ticker on the loop ran, i.e. how much each
+approach blocked the event-loop.
+
+Usage:
+    python group_commit_writer.py [directory-to-write-in]
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import os
+import sys
+import tempfile
+import time
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+class GroupCommitWriter:
+
+    def __init__(self, path: str, buffer_size: int = 1024 * 1024, fsync_interval: float = 0.002, max_buffered: int = 64 * 1024 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self.max_buffered = max_buffered
+        self.num_commits = 0
+
+        self._fd = None
+        self._executor = None
+        self._committer = None
+        self._buffer = bytearray()
+        # Buffers that are full (or were written as-is), oldest first, waiting for the committer.
+        self._sealed = []
+        self._sealed_size = 0
+        # Bytes accepted by write() so far, and how many of those are known to be on disk.
+        self._written_offset = 0
+        self._synced_offset = 0
+        # (offset, future) pairs, in offset order: sync() calls waiting for the synced offset to reach theirs.
+        self._waiters = collections.deque()
+        self._has_data = asyncio.Event()
+        self._commit_now = asyncio.Event()
+        self._closing = False
+        self._error = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="group-commit")
+        self._committer = asyncio.create_task(self._commit_loop())
+
+    def write(self, data: bytes):
+        if self._error is not None:
+            raise self._error
+        if self._closing:
+            raise RuntimeError("write() on a closed GroupCommitWriter")
+        if len(data) >= self.buffer_size:
+            self._seal()
+            self._sealed.append(bytes(data))
+            self._sealed_size += len(data)
+        else:
+            self._buffer += data
+            if len(self._buffer) >= self.buffer_size:
+                self._seal()
+        self._written_offset += len(data)
+        self._has_data.set()
+        if self._sealed_size >= self.buffer_size:
+            self._commit_now.set()
+
+    def _seal(self):
+        if self._buffer:
+            self._sealed.append(self._buffer)
+            self._sealed_size += len(self._buffer)
+            self._buffer = bytearray()
+
+    async def sync(self):
+        """Return once everything written so far is on disk."""
+        if self._error is not None:
+            raise self._error
+        if self._synced_offset >= self._written_offset:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((self._written_offset, future))
+        await future
+
+    async def drain(self):
+        if self._written_offset - self._synced_offset > self.max_buffered:
+            await self.sync()
+
+    async def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._has_data.set()
+        self._commit_now.set()
+        try:
+            await self._committer
+        finally:
+            self._executor.shutdown()
+            os.close(self._fd)
+        if self._error is not None:
+            raise self._error
+
+    def _write_and_sync(self, buffers: list):
+        """Runs on the background thread."""
+        for start in range(0, len(buffers), IOV_MAX):
+            batch = buffers[start:start + IOV_MAX]
+            num_written = os.writev(self._fd, batch)
+            if num_written < sum(len(buffer) for buffer in batch):
+                # A short write: finish off what's left with plain writes.
+                remainder = memoryview(b"".join(batch))[num_written:]
+                while remainder:
+                    remainder = remainder[os.write(self._fd, remainder):]
+        _fdatasync(self._fd)
+
+    async def _commit_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._written_offset == self._synced_offset:
+                if self._closing:
+                    return
+                self._has_data.clear()
+                await self._has_data.wait()
+                continue
+
+            # Give other writers a chance to join this commit, unless the buffers already filled up.
+            if not self._commit_now.is_set():
+                try:
+                    async with asyncio.timeout(self.fsync_interval):
+                        await self._commit_now.wait()
+                except TimeoutError:
+                    pass
+            self._commit_now.clear()
+
+            self._seal()
+            buffers, self._sealed, self._sealed_size = self._sealed, [], 0
+            offset = self._written_offset
+            try:
+                await loop.run_in_executor(self._executor, self._write_and_sync, buffers)
+            except OSError as exc:
+                self._error = exc
+                for _, future in self._waiters:
+                    if not future.done():
+                        future.set_exception(exc)
+                self._waiters.clear()
+                return
+            self.num_commits += 1
+            self._synced_offset = offset
+            while self._waiters and self._waiters[0][0] <= offset:
+                _, future = self._waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
+
+
+RECORD = b"Mars-Aero-Snickers-Twix-Reeses \n"
+
+
+async def write_and_fsync_on_loop(path: str, num_writers: int, records_per_writer: int):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    async def writer():
+        for _ in range(records_per_writer):
+            os.write(fd, RECORD)
+            _fdatasync(fd)
+            # Other writers get a turn in between, as they would between requests.
+            await asyncio.sleep(0)
+
+    try:
+        await asyncio.gather(*(writer() for _ in range(num_writers)))
+    finally:
+        os.close(fd)
+
+
+async def write_and_fsync_in_thread(path: str, num_writers: int, records_per_writer: int):
+    loop = asyncio.get_running_loop()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def write_record():
+        os.write(fd, RECORD)
+        _fdatasync(fd)
+
+    async def writer():
+        for _ in range(records_per_writer):
+            await loop.run_in_executor(None, write_record)
+
+    try:
+        await asyncio.gather(*(writer() for _ in range(num_writers)))
+    finally:
+        os.close(fd)
+
+
+async def group_commit(path: str, num_writers: int, records_per_writer: int):
+    async with GroupCommitWriter(path) as group_writer:
+
+        async def writer():
+            for _ in range(records_per_writer):
+                group_writer.write(RECORD)
+                await group_writer.sync()
+
+        await asyncio.gather(*(writer() for _ in range(num_writers)))
+    return group_writer.num_commits
+
+
+async def group_commit_sync_once(path: str, num_writers: int, records_per_writer: int):
+    # Writers that only need their records durable at the end, e.g. a bulk load.
+    async with GroupCommitWriter(path) as group_writer:
+
+        async def writer():
+            for _ in range(records_per_writer):
+                group_writer.write(RECORD)
+                await group_writer.drain()
+            await group_writer.sync()
+
+        await asyncio.gather(*(writer() for _ in range(num_writers)))
+    return group_writer.num_commits
+
+
+async def ticker(interval: float, lateness: list):
+    while True:
+        start_time = time.perf_counter()
+        await asyncio.sleep(interval)
+        lateness.append(time.perf_counter() - start_time - interval)
+
+
+async def run_one(approach, path: str, num_writers: int, records_per_writer: int):
+    lateness = []
+    ticker_task = asyncio.create_task(ticker(0.001, lateness))
+    start_time = time.perf_counter()
+    num_commits = await approach(path, num_writers, records_per_writer)
+    time_elapsed = time.perf_counter() - start_time
+    ticker_task.cancel()
+    num_records = num_writers * records_per_writer
+    assert os.path.getsize(path) == num_records * len(RECORD)
+    commits = f", {num_commits:,} commits" if num_commits else ""
+    print(
+        f"{approach.__name__:>26}: {num_records / time_elapsed:9,.0f} durable records/s, "
+        f"loop ran late by up to {max(lateness, default=0) * 1e3:6.1f}ms{commits}."
+    )
+
+
+async def main(directory: str):
+    num_writers, records_per_writer = 100, 50
+    print(f"{num_writers} coroutines, each appending {records_per_writer} {len(RECORD)}-byte records & waiting for them to be durable:")
+    for approach in (write_and_fsync_on_loop, write_and_fsync_in_thread, group_commit, group_commit_sync_once):
+        with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+            await run_one(approach, os.path.join(tmp_dir, "candy-log"), num_writers, records_per_writer)
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "."
+    asyncio.run(main(directory))
@@ -0,0 +1,138 @@
+"""
+Random access into candy-database by line number.
+
+read_database_asynchronously.py and use_select.py can only get at candy-database
+front-to-back: fh.read() / afh.read() of the whole 2GiB. To look at line 40 million,
+you'd first have to read (and find the newlines in) everything before it.
+
+build_index scans the file once and writes a sidecar file, candy-database.idx,
+holding the byte-offset where each line starts, as raw unsigned 64-bit integers.
+The last entry is the file's size, so line i always spans
+    [offsets[i], offsets[i + 1]).
+That's exactly an array('Q') on disk, so np.fromfile(path, dtype=np.uint64) or
+np.memmap read it directly too.
+
+The scan is split into chunks and each chunk is handled by a separate process,
+working on its own mmap of the file. Within a chunk, the newlines are found with
+NumPy if it's installed (one vectorized comparison over the whole chunk), otherwise
+with repeated bytes.find, which still runs in C.
+
+LineIndex memory-maps the sidecar, so opening it doesn't read it either. Then
+read_lines fetches any range of lines with a single os.pread. Regular files are
+always "ready" (see non-blocking-read.py), so the pread runs in the loop's default
+executor to keep it from blocking the event-loop.
+
+Usage:
+    python line_index.py [path-to-candy-database]
+"""
+
+import array
+import asyncio
+import mmap
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _newline_offsets_in_chunk(path: str, start: int, stop: int) -> bytes:
+    """Return the offsets just past each newline in [start, stop), packed as array('Q') bytes."""
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if np is not None:
+            chunk = np.frombuffer(mm, dtype=np.uint8, count=stop - start, offset=start)
+            offsets = (np.flatnonzero(chunk == ord("\n")).astype(np.uint64) + (start + 1)).tobytes()
+            # chunk is a view into mm: closing mm while it's alive raises BufferError.
+            del chunk
+            return offsets
+
+        offsets = array.array("Q")
+        position = mm.find(b"\n", start, stop)
+        while position != -1:
+            offsets.append(position + 1)
+            position = mm.find(b"\n", position + 1, stop)
+        return offsets.tobytes()
+
+
+def index_path_for(path: str) -> str:
+    return path + ".idx"
+
+
+def build_index(path: str, chunk_size: int = CHUNK_SIZE, num_processes: int = None) -> str:
+    file_size = os.path.getsize(path)
+    chunks = [(path, start, min(start + chunk_size, file_size)) for start in range(0, file_size, chunk_size)]
+
+    with multiprocessing.Pool(num_processes) as pool:
+        chunk_offsets = pool.starmap(_newline_offsets_in_chunk, chunks)
+
+    index_path = index_path_for(path)
+    with open(index_path, "wb") as fh:
+        fh.write(array.array("Q", [0]).tobytes())
+        last_offset = 0
+        for offsets in chunk_offsets:
+            fh.write(offsets)
+            if offsets:
+                last_offset = int.from_bytes(offsets[-8:], sys.byteorder)
+        # A final line without a trailing newline still needs its end marked.
+        if last_offset != file_size:
+            fh.write(array.array("Q", [file_size]).tobytes())
+    return index_path
+
+
+class LineIndex:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index_fh = open(index_path_for(path), "rb")
+        self._index_mmap = mmap.mmap(self._index_fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self._index_mmap).cast("Q")
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def byte_range(self, start_line: int, stop_line: int) -> tuple[int, int]:
+        return self.offsets[start_line], self.offsets[stop_line]
+
+    async def read_lines(self, start_line: int, stop_line: int) -> list[bytes]:
+        """Return lines [start_line, stop_line) with one pread."""
+        start, stop = self.byte_range(start_line, stop_line)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, os.pread, self._fd, stop - start, start)
+        return data.splitlines(keepends=True)
+
+    def close(self):
+        self.offsets.release()
+        self._index_mmap.close()
+        self._index_fh.close()
+        os.close(self._fd)
+
+
+async def random_lookups(line_index: LineIndex, num_lookups: int, lines_per_lookup: int):
+    start_time = time.time()
+    for _ in range(num_lookups):
+        start_line = random.randrange(len(line_index) - lines_per_lookup)
+        lines = await line_index.read_lines(start_line, start_line + lines_per_lookup)
+        assert len(lines) == lines_per_lookup
+    print(f"{num_lookups} random lookups of {lines_per_lookup} lines took: {time.time() - start_time:.2f}s.")
+    print(f"A sample line: {lines[0]!r}.")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "candy-database"
+
+    start_time = time.time()
+    index_path = build_index(path)
+    print(f"Built {index_path} ({'numpy' if np is not None else 'bytes.find'} scan) in: {time.time() - start_time:.2f}s.")
+
+    line_index = LineIndex(path)
+    print(f"{path} has {len(line_index):,} lines.")
+    asyncio.run(random_lookups(line_index, num_lookups=1000, lines_per_lookup=10))
+    line_index.close()
@@ -0,0 +1,194 @@
+"""
+A bounded, multi-stage streaming pipeline: source -> transforms -> sink.
+
+read_database_asynchronously.main runs read_db & compute_cumulative_sum side-by-side
+with gather. They overlap in time, but the compute never touches what was read. And
+read_db reads the whole 2GiB in one go before anything downstream could start.
+
+A Pipeline connects stages with bounded asyncio.Queues instead. Each item flows
+through every stage as soon as it's ready, and when a stage falls behind, the queue
+in front of it fills up and the stage before it blocks on put(). That's
+backpressure: memory use stays at (queue-size x item-size) per stage no matter how
+big the input is.
+
+Each Stage says how its function runs and how many copies run concurrently:
+    kind="async"    -- fn is a coroutine-function, awaited on the event-loop.
+    kind="thread"   -- fn runs in a thread-pool. For blocking I/O, e.g. file reads.
+    kind="process"  -- fn runs in a process-pool. For CPU-bound work. fn, its inputs
+                       & outputs must be picklable.
+With concurrency > 1, items can leave a stage in a different order than they arrived.
+
+While running, the pipeline samples each queue's occupancy. pipeline.report() then
+shows, per stage, its throughput, how busy its workers were, and how full its input
+queue was. The bottleneck is the stage with a full input queue & busy workers, whose
+downstream queue sits mostly empty.
+
+Usage:
+    python pipeline.py [path-to-candy-database]
+"""
+
+import asyncio
+import concurrent.futures
+import dataclasses
+import sys
+import time
+
+_END_OF_STREAM = object()
+
+
+@dataclasses.dataclass
+class Stage:
+    name: str
+    fn: callable
+    kind: str = "async"
+    concurrency: int = 1
+    queue_size: int = 8
+
+    # Filled in while the pipeline runs.
+    num_items: int = 0
+    busy_time: float = 0.0
+    occupancy_samples: list = dataclasses.field(default_factory=list)
+
+    def __post_init__(self):
+        if self.kind not in ("async", "thread", "process"):
+            raise ValueError(f"Unknown stage kind: {self.kind}.")
+        if self.queue_size <= 0:
+            # asyncio.Queue(maxsize=0) is unbounded: no backpressure, and no occupancy to report.
+            raise ValueError(f"queue_size must be positive, not {self.queue_size}.")
+
+
+class Pipeline:
+
+    def __init__(self, source, stages: list[Stage], sample_interval: float = 0.01):
+        """source is an iterable or async-iterable. The last stage is the sink; its return values are dropped."""
+        self.source = source
+        self.stages = stages
+        self.sample_interval = sample_interval
+        self.time_elapsed = None
+        self._executors = []
+
+    def _make_executor(self, stage: Stage):
+        if stage.kind == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=stage.concurrency)
+        elif stage.kind == "process":
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=stage.concurrency)
+        else:
+            return None
+        self._executors.append(executor)
+        return executor
+
+    async def _feed(self, queue: asyncio.Queue):
+        if hasattr(self.source, "__aiter__"):
+            async for item in self.source:
+                await queue.put(item)
+        else:
+            for item in self.source:
+                await queue.put(item)
+        await queue.put(_END_OF_STREAM)
+
+    async def _worker(self, stage: Stage, executor, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await in_queue.get()
+            if item is _END_OF_STREAM:
+                # Put it back so this stage's other workers see it too.
+                await in_queue.put(_END_OF_STREAM)
+                return
+            start_time = time.perf_counter()
+            if executor is None:
+                result = await stage.fn(item)
+            else:
+                result = await loop.run_in_executor(executor, stage.fn, item)
+            stage.busy_time += time.perf_counter() - start_time
+            stage.num_items += 1
+            if out_queue is not None:
+                await out_queue.put(result)
+
+    async def _run_stage(self, stage: Stage, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        executor = self._make_executor(stage)
+        async with asyncio.TaskGroup() as task_group:
+            for _ in range(stage.concurrency):
+                task_group.create_task(self._worker(stage, executor, in_queue, out_queue))
+        if out_queue is not None:
+            await out_queue.put(_END_OF_STREAM)
+
+    async def _sample_occupancy(self, queues: list[asyncio.Queue]):
+        while True:
+            for stage, queue in zip(self.stages, queues):
+                stage.occupancy_samples.append(queue.qsize() / queue.maxsize)
+            await asyncio.sleep(self.sample_interval)
+
+    async def run(self):
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        start_time = time.perf_counter()
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                sampler = task_group.create_task(self._sample_occupancy(queues))
+                stage_tasks = [task_group.create_task(self._feed(queues[0]))]
+                for idx, stage in enumerate(self.stages):
+                    out_queue = queues[idx + 1] if idx + 1 < len(queues) else None
+                    stage_tasks.append(task_group.create_task(self._run_stage(stage, queues[idx], out_queue)))
+                await asyncio.gather(*stage_tasks)
+                sampler.cancel()
+        finally:
+            for executor in self._executors:
+                executor.shutdown(cancel_futures=True)
+            self._executors.clear()
+        self.time_elapsed = time.perf_counter() - start_time
+
+    def report(self) -> str:
+        lines = [f"Pipeline ran for {self.time_elapsed:.2f}s."]
+        for stage in self.stages:
+            samples = stage.occupancy_samples or [0.0]
+            utilization = stage.busy_time / (self.time_elapsed * stage.concurrency)
+            lines.append(
+                f"  {stage.name:>12} ({stage.kind}, x{stage.concurrency}): {stage.num_items / self.time_elapsed:8.1f} items/s, "
+                f"workers busy {utilization:4.0%}, input queue {sum(samples) / len(samples):4.0%} full on average "
+                f"({max(samples):.0%} max)."
+            )
+        return "\n".join(lines)
+
+
+def read_chunks(path: str, chunk_size: int):
+    # A plain generator; the "read" stage below does the actual (blocking) reading in a thread.
+    with open(path, "rb") as fh:
+        file_size = fh.seek(0, 2)
+    for offset in range(0, file_size, chunk_size):
+        yield path, offset, chunk_size
+
+
+def read_chunk(request: tuple[str, int, int]) -> bytes:
+    path, offset, chunk_size = request
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        return fh.read(chunk_size)
+
+
+def count_twix(chunk: bytes) -> int:
+    return chunk.count(b"Twix")
+
+
+async def main(path: str):
+    total = 0
+
+    async def cumulative_sum(count: int):
+        nonlocal total
+        total += count
+
+    pipeline = Pipeline(
+        # A multiple of the 32-byte record size, so no record is split across two chunks.
+        source=read_chunks(path, chunk_size=4 * 1024 * 1024),
+        stages=[
+            Stage("read", read_chunk, kind="thread", concurrency=2),
+            Stage("count_twix", count_twix, kind="process", concurrency=2),
+            Stage("sum", cumulative_sum, kind="async"),
+        ],
+    )
+    await pipeline.run()
+    print(f"Twix shows up {total:,} times in {path}.")
+    print(pipeline.report())
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "candy-database"
+    asyncio.run(main(path))
@@ -1,19 +1,40 @@
+import os
+import subprocess
 import time
-import selectors
 
-# This is the Selector chosen by DefaultSelector on my machine -- Mac M1.
-# I'm hard-coding it for easier snooping into its' methods.
-kqueue_selector = selectors.KqueueSelector()
+import event_selector
 
+# On my machine -- Mac M1 -- DefaultSelector is a KqueueSelector. I used to hard-code
+# that for easier snooping into its' methods, but kqueue doesn't exist on Linux, where
+# DefaultSelector is an EpollSelector instead. See event_selector.py for more on epoll.
+# A regular file isn't something a selector can usefully wait on: kqueue reports it as
+# always ready, and epoll refuses to watch it at all (register raises PermissionError).
+# So candy-database is read through a pipe instead, with `cat` on the other end, and the
+# selector says when there's something in the pipe to read.
+selector = event_selector.make_selector()
 
 
 start_time = time.time()
-with open("candy-database", "r") as fh:
-    
-    selector_key = kqueue_selector.register(fileobj=fh, events=selectors.EVENT_READ)
-    print("A")
-    v = kqueue_selector.select()
-    print("B")
-    import ipdb; ipdb.set_trace()
-    db = fh.read()
-print(f"Reading candy-database took: {time.time() - start_time:.2f} seconds.")
+cat = subprocess.Popen(["cat", "candy-database"], stdout=subprocess.PIPE)
+read_fd = cat.stdout.fileno()
+os.set_blocking(read_fd, False)
+selector.register(read_fd, event_selector.EVENT_READ)
+
+chunks = []
+num_selects = 0
+while True:
+    selector.select()
+    num_selects += 1
+    try:
+        data = os.read(read_fd, 1024 * 1024)
+    except BlockingIOError:
+        continue
+    if not data:
+        break
+    chunks.append(data)
+selector.unregister(read_fd)
+selector.close()
+cat.stdout.close()
+cat.wait()
+db = b"".join(chunks)
+print(f"Reading candy-database ({len(db):,} bytes, {num_selects:,} selects) took: {time.time() - start_time:.2f} seconds.")
@@ -16,6 +16,9 @@ class Task:
     Think of this as being like asyncio.Task/curio.Task.
     """
 
+    # No per-instance __dict__: with many tasks around, that adds up. See task_memory.py.
+    __slots__ = ("coro", "time_to_resume_coro")
+
     def __init__(self, coro, time_to_resume_coro: datetime.datetime):
         self.coro = coro
         self.time_to_resume_coro = time_to_resume_coro
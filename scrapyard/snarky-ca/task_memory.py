@@ -0,0 +1,166 @@
+"""
+How many bytes one idle task costs, measured with tracemalloc, and split into what
+the coroutine itself holds versus what the loop adds around it.
+
+Hundreds of thousands of rockets from countdown.py, each asleep in countdown.sleep,
+mostly sit there. What they cost is their memory. Each loop's share of that is:
+    asyncio         -- an asyncio.Task (with its callback list & a copy of the
+                       context), plus, while asleep, a Future, a TimerHandle for the
+                       wake-up, and the asyncio.sleep coroutine in between.
+    SleepingLoop    -- a countdown.Task, in a heap. countdown.Task used to keep its two
+                       attributes in a per-instance __dict__. It now declares
+                       __slots__, which drops the dict. DictTask below is the old
+                       version, for comparison.
+
+measure() builds num_tasks tasks in three steps, and attributes what tracemalloc saw
+allocated during each:
+    1. create the coroutines                   -> coroutine
+    2. wrap each in its loop's task            -> task
+    3. run each up to its first sleep          -> split by which file allocated it:
+       the loop's own code (asyncio's, or the heap here) counts as task overhead,
+       and the rest (the nested sleep coroutine, its deadline...) as coroutine.
+The coroutines' frames live inside the coroutine objects, so "coroutine" covers them.
+
+Per task, the numbers hold steady from 10^5 tasks up. tracemalloc's own bookkeeping
+takes several times what it measures, though, so 10^6 asyncio tasks need more memory
+than a small machine has.
+
+Usage:
+    python task_memory.py [num_tasks]
+"""
+
+import asyncio
+import contextlib
+import datetime
+import heapq
+import os
+import sys
+import tracemalloc
+
+import countdown
+
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class DictTask:
+    """countdown.Task as it was before __slots__."""
+
+    def __init__(self, coro, time_to_resume_coro: datetime.datetime):
+        self.coro = coro
+        self.time_to_resume_coro = time_to_resume_coro
+
+    def __lt__(self, other):
+        return self.time_to_resume_coro < other.time_to_resume_coro
+
+
+async def asyncio_countdown(rocket_name: str, countdown_secs: int, *, delay=0):
+    """countdown.countdown, for asyncio."""
+    print(f"{rocket_name} waiting {delay} seconds before starting countdown.")
+    await asyncio.sleep(delay)
+    while countdown_secs:
+        print(f"{rocket_name} T-minus {countdown_secs}")
+        await asyncio.sleep(1)
+        countdown_secs -= 1
+    print(rocket_name, 'lift-off!')
+
+
+class _Phases:
+    """Bytes allocated per phase. Only the last phase needs to know where they came from, and only it pays for snapshots."""
+
+    def __init__(self, loop_files: tuple):
+        self.loop_files = loop_files
+        self.traced = [tracemalloc.get_traced_memory()[0]]
+        self.snapshot = None
+
+    def mark(self):
+        self.traced.append(tracemalloc.get_traced_memory()[0])
+        if len(self.traced) == 3:
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def breakdown(self) -> dict:
+        """Call after the last phase. Stops tracemalloc, so cleaning up isn't traced."""
+        before, coroutines, tasks = self.traced
+        loop_bytes = other_bytes = 0
+        for stat in tracemalloc.take_snapshot().compare_to(self.snapshot, "filename"):
+            if stat.traceback[0].filename == tracemalloc.__file__:
+                continue
+            if stat.traceback[0].filename.startswith(self.loop_files):
+                loop_bytes += stat.size_diff
+            else:
+                other_bytes += stat.size_diff
+        tracemalloc.stop()
+        return {"coroutine": coroutines - before + other_bytes, "task": tasks - coroutines + loop_bytes}
+
+
+async def _measure_asyncio(num_tasks: int) -> dict:
+    slots = [None] * num_tasks
+    phases = _Phases((ASYNCIO_DIR,))
+    for idx in range(num_tasks):
+        slots[idx] = asyncio_countdown("A", 3, delay=3600)
+    phases.mark()
+    for idx in range(num_tasks):
+        slots[idx] = asyncio.create_task(slots[idx])
+    phases.mark()
+    # Every task's first step was scheduled before this sleep's wake-up, so all of them run up to their sleep.
+    await asyncio.sleep(0)
+    breakdown = phases.breakdown()
+
+    for task in slots:
+        task.cancel()
+    await asyncio.gather(*slots, return_exceptions=True)
+    return breakdown
+
+
+def _measure_sleeping_loop(num_tasks: int, task_cls) -> dict:
+    # The same steps as SleepingLoop.run_until_complete's start-up, one at a time.
+    slots = [None] * num_tasks
+    pending_tasks = []
+    phases = _Phases((__file__,))
+    for idx in range(num_tasks):
+        slots[idx] = countdown.countdown("A", 3, delay=3600)
+    phases.mark()
+    for idx in range(num_tasks):
+        slots[idx] = task_cls(slots[idx], None)
+    phases.mark()
+    for task in slots:
+        task.time_to_resume_coro = task.coro.send(None)
+        heapq.heappush(pending_tasks, task)
+    breakdown = phases.breakdown()
+
+    for task in slots:
+        task.coro.close()
+    return breakdown
+
+
+def measure(num_tasks: int, task_cls=None) -> dict:
+    """{"coroutine": bytes, "task": bytes} for num_tasks idle rockets. With task_cls, on SleepingLoop; otherwise on asyncio."""
+    tracemalloc.start()
+    try:
+        # The rockets print as they start; that's not what's being measured.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if task_cls is None:
+                return asyncio.run(_measure_asyncio(num_tasks))
+            return _measure_sleeping_loop(num_tasks, task_cls)
+    finally:
+        tracemalloc.stop()
+
+
+def main(num_tasks: int):
+    print(f"{num_tasks:,} idle countdown rockets, in bytes per task:")
+    print(f"{'':>33} {'coroutine':>9} + {'task':>5} = {'total':>5}")
+    results = {
+        "asyncio.Task": measure(num_tasks),
+        "SleepingLoop, DictTask": measure(num_tasks, DictTask),
+        "SleepingLoop, countdown.Task": measure(num_tasks, countdown.Task),
+    }
+    for name, result in results.items():
+        coroutine, task = result["coroutine"] / num_tasks, result["task"] / num_tasks
+        print(f"{name:>33} {coroutine:9.0f} + {task:5.0f} = {coroutine + task:5.0f}")
+    asyncio_total = sum(results["asyncio.Task"].values())
+    compact_total = sum(results["SleepingLoop, countdown.Task"].values())
+    print(f"A compact task takes {compact_total / asyncio_total:.0%} of what an asyncio one does.")
+
+
+if __name__ == "__main__":
+    num_tasks = int(float(sys.argv[1])) if len(sys.argv) > 1 else 100_000
+    main(num_tasks)
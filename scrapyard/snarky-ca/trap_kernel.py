@@ -0,0 +1,231 @@
+"""
+A minimal kernel, in the style of countdown.py's SleepingLoop, where coroutines
+yield small "trap" tuples.
+
+8-rock-example.py and countdown.sleep show that whatever a coroutine yields from
+__await__ lands directly in the hands of whoever called .send(), i.e. the event-loop.
+asyncio uses that channel to pass back Futures: to sleep, asyncio creates a Future,
+a TimerHandle to resolve it, and a done-callback Handle to wake the Task back up.
+
+Here, coroutines instead yield a tuple that says what they're waiting for, and the
+kernel acts on it directly, like a system-call trap (this is how curio works):
+    (SLEEP, seconds)        -- resume after `seconds`.
+    (WAIT_READ, fileobj)    -- resume once fileobj is readable.
+    (WAIT_WRITE, fileobj)   -- resume once fileobj is writable.
+    (SPAWN, coro)           -- start coro as a new Task and resume straight away with it.
+    (JOIN, task)            -- resume with the finished task once it's done.
+No Futures, no callbacks and no Handles. A Task is just the coroutine, its result and
+who's waiting to join it.
+
+Running this file benchmarks, against asyncio, the cost of one task-switch and the
+memory used by 100k tasks that are all asleep.
+"""
+
+import asyncio
+import collections
+import heapq
+import selectors
+import sys
+import time
+import tracemalloc
+import types
+
+SLEEP, WAIT_READ, WAIT_WRITE, SPAWN, JOIN = range(5)
+
+
+@types.coroutine
+def sleep(seconds: float):
+    yield (SLEEP, seconds)
+
+
+@types.coroutine
+def wait_read(fileobj):
+    yield (WAIT_READ, fileobj)
+
+
+@types.coroutine
+def wait_write(fileobj):
+    yield (WAIT_WRITE, fileobj)
+
+
+@types.coroutine
+def spawn(coro) -> "Task":
+    return (yield (SPAWN, coro))
+
+
+@types.coroutine
+def join(task: "Task"):
+    return (yield (JOIN, task))
+
+
+class Task:
+
+    __slots__ = ("coro", "result", "exception", "done", "joiners")
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.result = None
+        self.exception = None
+        self.done = False
+        self.joiners = None
+
+
+class Kernel:
+
+    def __init__(self):
+        # (task, value-to-send) pairs, ready to run.
+        self.ready = collections.deque()
+        # (time_to_resume, tie-breaker, task). The tie-breaker stops heapq from comparing Tasks.
+        self.sleeping = []
+        self._sleep_count = 0
+        self.selector = selectors.DefaultSelector()
+
+    def spawn(self, coro) -> Task:
+        task = Task(coro)
+        self.ready.append((task, None))
+        return task
+
+    def _finish(self, task: Task, result=None, exception=None):
+        task.done, task.result, task.exception = True, result, exception
+        if task.joiners:
+            for joiner in task.joiners:
+                self.ready.append((joiner, task))
+
+    def _wait_io(self, task: Task, fileobj, event: int):
+        self.selector.register(fileobj, event, task)
+
+    def run(self, main_coro):
+        """Run until main_coro finishes and return its result. Other tasks still pending are abandoned."""
+        main_task = self.spawn(main_coro)
+        ready, sleeping, selector = self.ready, self.sleeping, self.selector
+
+        while not main_task.done:
+            if not ready:
+                timeout = None
+                if sleeping:
+                    timeout = max(0.0, sleeping[0][0] - time.monotonic())
+                if selector.get_map():
+                    for key, _ in selector.select(timeout):
+                        selector.unregister(key.fileobj)
+                        ready.append((key.data, None))
+                elif timeout:
+                    time.sleep(timeout)
+                now = time.monotonic()
+                while sleeping and sleeping[0][0] <= now:
+                    ready.append((heapq.heappop(sleeping)[2], None))
+                continue
+
+            task, value = ready.popleft()
+            try:
+                trap, arg = task.coro.send(value)
+            except StopIteration as exc:
+                self._finish(task, result=exc.value)
+                continue
+            except BaseException as exc:
+                self._finish(task, exception=exc)
+                if task is main_task:
+                    raise
+                continue
+
+            if trap == SLEEP:
+                if arg <= 0:
+                    ready.append((task, None))
+                else:
+                    self._sleep_count += 1
+                    heapq.heappush(sleeping, (time.monotonic() + arg, self._sleep_count, task))
+            elif trap == SPAWN:
+                ready.append((task, self.spawn(arg)))
+            elif trap == JOIN:
+                if arg.done:
+                    ready.append((task, arg))
+                else:
+                    if arg.joiners is None:
+                        arg.joiners = []
+                    arg.joiners.append(task)
+            elif trap == WAIT_READ:
+                self._wait_io(task, arg, selectors.EVENT_READ)
+            elif trap == WAIT_WRITE:
+                self._wait_io(task, arg, selectors.EVENT_WRITE)
+            else:
+                raise RuntimeError(f"Unknown trap: {trap}.")
+
+        return main_task.result
+
+
+async def join_result(task: Task):
+    """JOIN resumes with the finished Task itself. This unwraps its result (or exception)."""
+    finished = await join(task)
+    if finished.exception is not None:
+        raise finished.exception
+    return finished.result
+
+
+async def kernel_switcher(num_switches: int):
+    for _ in range(num_switches):
+        await sleep(0)
+
+
+async def kernel_switch_benchmark(num_tasks: int, num_switches: int):
+    tasks = [await spawn(kernel_switcher(num_switches)) for _ in range(num_tasks)]
+    for task in tasks:
+        await join_result(task)
+
+
+async def asyncio_switcher(num_switches: int):
+    for _ in range(num_switches):
+        await asyncio.sleep(0)
+
+
+async def asyncio_switch_benchmark(num_tasks: int, num_switches: int):
+    await asyncio.gather(*(asyncio_switcher(num_switches) for _ in range(num_tasks)))
+
+
+async def kernel_memory_benchmark(num_tasks: int) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tasks = [await spawn(sleep(3600)) for _ in range(num_tasks)]
+    # Let every task run up to its sleep.
+    await sleep(0)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before
+
+
+async def asyncio_memory_benchmark(num_tasks: int) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tasks = [asyncio.create_task(asyncio.sleep(3600)) for _ in range(num_tasks)]
+    await asyncio.sleep(0)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return after - before
+
+
+def main(num_tasks: int):
+    num_switches = 100
+    total_switches = num_tasks // 100 * num_switches
+
+    start_time = time.perf_counter()
+    Kernel().run(kernel_switch_benchmark(num_tasks // 100, num_switches))
+    kernel_switch_time = (time.perf_counter() - start_time) / total_switches
+
+    start_time = time.perf_counter()
+    asyncio.run(asyncio_switch_benchmark(num_tasks // 100, num_switches))
+    asyncio_switch_time = (time.perf_counter() - start_time) / total_switches
+
+    print(f"Per task-switch: kernel {kernel_switch_time * 1e9:.0f}ns, asyncio {asyncio_switch_time * 1e9:.0f}ns.")
+
+    kernel_memory = Kernel().run(kernel_memory_benchmark(num_tasks))
+    asyncio_memory = asyncio.run(asyncio_memory_benchmark(num_tasks))
+    print(
+        f"{num_tasks:,} sleeping tasks: kernel {kernel_memory / num_tasks:.0f} bytes/task, "
+        f"asyncio {asyncio_memory / num_tasks:.0f} bytes/task."
+    )
+
+
+if __name__ == "__main__":
+    num_tasks = int(float(sys.argv[1])) if len(sys.argv) > 1 else 100_000
+    main(num_tasks)
@@ -0,0 +1,66 @@
+"""
+Run countdown.py's SleepingLoop on a virtual clock.
+
+SleepingLoop & sleep read the time via datetime.datetime.now() and wait via
+time.sleep(). VirtualSleepingLoop swaps both out, for the duration of
+run_until_complete, with a clock that only moves when the loop would otherwise
+have slept. Then it jumps straight to the next deadline. The rockets still print
+the same waits, but lift off in milliseconds instead of seconds.
+
+See ../virtual_time.py for the same idea applied to asyncio's event-loop.
+"""
+
+import datetime
+import time
+import types
+
+import countdown
+
+
+class VirtualClock:
+
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    def sleep(self, seconds: float):
+        self.current += datetime.timedelta(seconds=seconds)
+
+
+class VirtualSleepingLoop(countdown.SleepingLoop):
+
+    def __init__(self, *coros, start: datetime.datetime = datetime.datetime(2000, 1, 1)):
+        super().__init__(*coros)
+        self.clock = VirtualClock(start)
+
+    def run_until_complete(self):
+        # countdown.py looks these modules up as globals, so swap in stand-ins that use our clock.
+        virtual_datetime = types.SimpleNamespace(
+            datetime=types.SimpleNamespace(now=self.clock.now),
+            timedelta=datetime.timedelta,
+        )
+        virtual_time = types.SimpleNamespace(sleep=self.clock.sleep)
+        real_datetime, real_time = countdown.datetime, countdown.time
+        countdown.datetime, countdown.time = virtual_datetime, virtual_time
+        try:
+            super().run_until_complete()
+        finally:
+            countdown.datetime, countdown.time = real_datetime, real_time
+
+
+def main():
+    loop = VirtualSleepingLoop(
+        countdown.countdown('A', 5),
+        countdown.countdown('B', 3, delay=2),
+        countdown.countdown('C', 4, delay=1),
+    )
+    start_time = time.perf_counter()
+    loop.run_until_complete()
+    print(f"Virtual time elapsed: {loop.clock.now() - datetime.datetime(2000, 1, 1)}.")
+    print(f"Real time elapsed: {time.perf_counter() - start_time:.3f}s.")
+
+
+if __name__ == '__main__':
+    main()
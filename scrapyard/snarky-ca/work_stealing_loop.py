@@ -0,0 +1,184 @@
+"""
+A multi-threaded, work-stealing variant of countdown.py's SleepingLoop.
+
+SleepingLoop.run_until_complete resumes every coroutine from one thread, using one
+heap. On a free-threaded build of CPython (3.13t and later) several threads can run
+Python code at the same time, so CPU-bound coroutines, like uniform_sum from
+async_approach.py, could make progress in parallel.
+
+WorkStealingLoop starts num_workers threads. Each worker has its own run-queue (a
+deque of coroutines ready to resume) and its own timer heap (coroutines waiting on
+a sleep), each guarded by the worker's own lock, so workers don't contend on a
+single shared queue. When a worker runs out of ready coroutines, it steals half of
+another worker's run-queue, from the opposite end to the one its owner pops from.
+
+A coroutine is only ever resumed by one thread at a time, and a single step (from one
+.send() to the next yield) runs entirely on one thread. Between steps it may move.
+
+Coroutines speak the same protocol as with SleepingLoop, plus one addition:
+    yield <datetime>  -- resume me at (or after) this time, like countdown.sleep.
+    yield None        -- I'm not waiting on anything, just letting others run.
+
+Running this file times a batch of CPU-bound coroutines with 1, 2, ... up to
+os.cpu_count() workers. With the GIL enabled, the threads still take turns, so
+expect no speedup there; it's only on a free-threaded build that this scales.
+"""
+
+import collections
+import datetime
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+import countdown
+
+
+class _Task:
+
+    __slots__ = ("coro", "idx", "send_value")
+
+    def __init__(self, coro, idx: int):
+        self.coro = coro
+        self.idx = idx
+        self.send_value = None
+
+
+class _Worker:
+
+    def __init__(self, loop: "WorkStealingLoop", worker_idx: int):
+        self.loop = loop
+        self.worker_idx = worker_idx
+        self.lock = threading.Lock()
+        self.run_queue = collections.deque()
+        # (time_to_resume, tie-breaker, task).
+        self.timers = []
+        self.num_steals = 0
+
+    def _pop_ready(self):
+        with self.lock:
+            if self.timers:
+                now = datetime.datetime.now()
+                while self.timers and self.timers[0][0] <= now:
+                    task = heapq.heappop(self.timers)[2]
+                    task.send_value = now
+                    self.run_queue.append(task)
+            if self.run_queue:
+                return self.run_queue.popleft()
+        return None
+
+    def _steal(self):
+        victims = [worker for worker in self.loop.workers if worker is not self]
+        random.shuffle(victims)
+        for victim in victims:
+            with victim.lock:
+                num_to_steal = (len(victim.run_queue) + 1) // 2
+                stolen = [victim.run_queue.pop() for _ in range(num_to_steal)]
+            if stolen:
+                self.num_steals += 1
+                task = stolen.pop()
+                with self.lock:
+                    self.run_queue.extend(stolen)
+                return task
+        return None
+
+    def _idle_wait(self):
+        with self.lock:
+            next_timer = self.timers[0][0] if self.timers else None
+        delay = 0.001
+        if next_timer is not None:
+            delay = min(delay, max(0.0, (next_timer - datetime.datetime.now()).total_seconds()))
+        time.sleep(delay)
+
+    def run(self):
+        while self.loop.num_live > 0:
+            task = self._pop_ready() or self._steal()
+            if task is None:
+                self._idle_wait()
+                continue
+            try:
+                time_to_resume = task.coro.send(task.send_value)
+            except StopIteration as exc:
+                self.loop._finish(task, exc.value)
+                continue
+            except BaseException as exc:
+                self.loop._finish(task, exc)
+                continue
+            if time_to_resume is None:
+                task.send_value = None
+                with self.lock:
+                    self.run_queue.append(task)
+            else:
+                with self.lock:
+                    heapq.heappush(self.timers, (time_to_resume, next(self.loop.tie_breaker), task))
+
+
+class WorkStealingLoop:
+
+    def __init__(self, *coros, num_workers: int = None):
+        self.coros = coros
+        self.workers = [_Worker(self, idx) for idx in range(num_workers or os.cpu_count())]
+        self.results = [None] * len(coros)
+        self.num_live = len(coros)
+        self._live_lock = threading.Lock()
+        self.tie_breaker = itertools.count()
+
+    def _finish(self, task: _Task, result):
+        self.results[task.idx] = result
+        with self._live_lock:
+            self.num_live -= 1
+
+    def run_until_complete(self) -> list:
+        """Run every coroutine to completion. Returns their results (or the exceptions they raised), in order."""
+        for idx, coro in enumerate(self.coros):
+            self.workers[idx % len(self.workers)].run_queue.append(_Task(coro, idx))
+        threads = [threading.Thread(target=worker.run, name=f"worker-{worker.worker_idx}") for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
+
+
+class YieldToLoop:
+    def __await__(self):
+        yield None
+
+
+async def uniform_sum(n_samples: int, n_chunks: int = 40) -> float:
+    """Like async_approach.uniform_sum, yielding to the loop between chunks."""
+    total = 0.0
+    chunk_size = n_samples // n_chunks
+    for _ in range(n_chunks):
+        for _ in range(chunk_size):
+            total += random.random()
+        await YieldToLoop()
+    return total
+
+
+def main():
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"GIL enabled: {gil_enabled}. CPU count: {os.cpu_count()}.")
+
+    # A countdown rocket rides along, to show sleeping coroutines work too.
+    results = WorkStealingLoop(countdown.countdown('A', 2), uniform_sum(100_000), num_workers=2).run_until_complete()
+    print(f"Mixed run results: {results}.\n")
+
+    num_coros, n_samples = 16, 1_000_000
+    baseline = None
+    cpu_count = os.cpu_count()
+    for num_workers in sorted({2**power for power in range(cpu_count.bit_length())} | {cpu_count}):
+        loop = WorkStealingLoop(*(uniform_sum(n_samples) for _ in range(num_coros)), num_workers=num_workers)
+        start_time = time.perf_counter()
+        loop.run_until_complete()
+        time_elapsed = time.perf_counter() - start_time
+        baseline = baseline or time_elapsed
+        num_steals = sum(worker.num_steals for worker in loop.workers)
+        print(f"{num_workers:>3} workers: {time_elapsed:.2f}s, speedup {baseline / time_elapsed:.2f}x, {num_steals} steals.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+A low-jitter mode for call_at & sleep.
+
+hypotheses/3-loop-call-later-and-loop-call-at-are-best-effort-not-guarantees.py
+shows callbacks being invoked late. Some of that lateness comes from other
+callbacks hogging the event-loop, which nothing short of not-hogging fixes.
+The rest comes from how the loop waits: it asks selector.select() to sleep
+until the next deadline, and the OS wakes the thread up whenever it gets around
+to it. That's typically tens of microseconds to a couple of milliseconds late.
+
+The precise variants here split the wait in two:
+    1. Let the loop sleep in select() (so other tasks keep running) until
+       spin_budget seconds before the deadline.
+    2. Then busy-wait on time.perf_counter_ns() for the remaining sliver and
+       invoke the callback right on the deadline.
+
+The spin is time the event-loop can't spend on anything else, so keep the
+budget small. It only needs to cover the OS's wake-up slop.
+
+Running this file measures p50/p99 lateness of asyncio.sleep against precise_sleep.
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+DEFAULT_SPIN_BUDGET = 0.002
+
+
+def _spin_then_run(deadline_ns: int, callback, args):
+    while time.perf_counter_ns() < deadline_ns:
+        pass
+    callback(*args)
+
+
+def call_at_precise(loop: asyncio.AbstractEventLoop, when: float, callback, *args, spin_budget: float = DEFAULT_SPIN_BUDGET) -> asyncio.TimerHandle:
+    """Like loop.call_at(when, callback, *args), but spins for up to spin_budget seconds to land on `when`."""
+    # loop.time() and perf_counter may be different clocks. Translate the deadline once, up-front.
+    deadline_ns = time.perf_counter_ns() + int((when - loop.time()) * 1e9)
+    return loop.call_at(when - spin_budget, _spin_then_run, deadline_ns, callback, args)
+
+
+def call_later_precise(loop: asyncio.AbstractEventLoop, delay: float, callback, *args, spin_budget: float = DEFAULT_SPIN_BUDGET) -> asyncio.TimerHandle:
+    return call_at_precise(loop, loop.time() + delay, callback, *args, spin_budget=spin_budget)
+
+
+def _set_result_unless_done(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+async def precise_sleep(seconds: float, result=None, spin_budget: float = DEFAULT_SPIN_BUDGET):
+    """Like asyncio.sleep(seconds), but wakes up (nearly) exactly on time."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    handle = call_later_precise(loop, seconds, _set_result_unless_done, future, result, spin_budget=spin_budget)
+    try:
+        return await future
+    finally:
+        handle.cancel()
+
+
+async def measure_lateness(sleep, num_sleeps: int) -> list[float]:
+    """Run num_sleeps sleeps of 1-20ms back-to-back and return how late each one woke up, in seconds."""
+    lateness = []
+    for _ in range(num_sleeps):
+        seconds = random.uniform(0.001, 0.02)
+        start_ns = time.perf_counter_ns()
+        await sleep(seconds)
+        lateness.append((time.perf_counter_ns() - start_ns) / 1e9 - seconds)
+    return lateness
+
+
+async def background_chatter(stop_event: asyncio.Event):
+    # Some other, well-behaved tasks doing 50us slices of work so the loop isn't entirely idle.
+    while not stop_event.is_set():
+        deadline = time.perf_counter() + 50e-6
+        while time.perf_counter() < deadline:
+            pass
+        await asyncio.sleep(random.uniform(0.0005, 0.005))
+
+
+def summarize(name: str, lateness: list[float]):
+    percentiles = statistics.quantiles(lateness, n=100)
+    print(
+        f"{name:>28}: p50 {percentiles[49] * 1e6:8.0f}us, p99 {percentiles[98] * 1e6:8.0f}us, "
+        f"max {max(lateness) * 1e6:8.0f}us."
+    )
+
+
+async def main(num_sleeps: int):
+    stop_event = asyncio.Event()
+    chatter = [asyncio.create_task(background_chatter(stop_event)) for _ in range(4)]
+
+    print(f"Lateness over {num_sleeps} sleeps of 1-20ms each, with 4 background tasks running:")
+    summarize("asyncio.sleep", await measure_lateness(asyncio.sleep, num_sleeps))
+    for spin_budget in (0.0005, 0.002):
+        def sleep(seconds):
+            return precise_sleep(seconds, spin_budget=spin_budget)
+        lateness = await measure_lateness(sleep, num_sleeps)
+        summarize(f"precise_sleep (spin {spin_budget * 1e3}ms)", lateness)
+
+    stop_event.set()
+    await asyncio.gather(*chatter)
+
+
+if __name__ == "__main__":
+    num_sleeps = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    asyncio.run(main(num_sleeps))
@@ -0,0 +1,255 @@
+"""
+A hierarchical timing-wheel for huge numbers of call_later timers.
+
+hypotheses/3-loop-call-later-and-loop-call-at-are-best-effort-not-guarantees.py
+pokes at loop.call_later & loop.call_at. Under the hood, the event-loop keeps
+every TimerHandle in one binary heap (loop._scheduled). Adding a timer is
+O(log n), and cancelling one doesn't remove it. It just marks the handle
+cancelled and leaves it sat in the heap until it reaches the top, or until
+more than half the heap is cancelled and the loop rebuilds it.
+
+That's a fine trade-off for a few timers. It's not great for a per-connection
+timeout on hundreds of thousands of connections, where nearly every timer is
+cancelled (the response arrived in time) and re-armed.
+
+A timing-wheel buckets timers by the tick they expire on instead:
+    - Level 0 has one slot per tick, e.g. 256 slots of 1ms.
+    - Level 1 has one slot per full turn of level 0, i.e. 256 slots of 256ms.
+    - Level 2 has 256 slots of 65.5s. And so on.
+Scheduling a timer computes which slot it belongs in and adds it to that slot's
+set: O(1). Cancelling removes it from the set: O(1). Each time a lower level
+completes a full turn, the next slot of the level above is emptied and its timers
+are re-inserted (cascaded) into the finer levels below.
+
+The catch is the resolution. Timers fire on a tick boundary, so a timer can be up
+to one tick late (on top of however late the event-loop is anyway).
+
+The whole wheel is driven by a single loop.call_at timer of its own.
+
+Written in pure Python, scheduling is a constant factor slower than the C heapq
+the loop uses. What the wheel buys you is that cancelled timers are gone right
+away (no lingering handles, no heap rebuilds) and that the per-timer cost stays
+flat no matter how many timers are pending. Run this file for a comparison at
+10^6 timers (or pass a different count as the first argument).
+
+Usage:
+    wheel = TimingWheel(loop, tick=0.001)
+    handle = wheel.call_later(5.0, on_timeout, conn)
+    handle.cancel()
+"""
+
+import asyncio
+import math
+import random
+import sys
+import time
+
+
+class WheelTimerHandle(asyncio.Handle):
+    """Returned by TimingWheel.call_later. Behaves like the TimerHandle from loop.call_later."""
+
+    __slots__ = ("_when", "_expire_tick", "_slot", "_wheel")
+
+    def __init__(self, when: float, expire_tick: int, wheel: "TimingWheel", callback, args, context=None):
+        super().__init__(callback, args, wheel.loop, context)
+        self._when = when
+        self._expire_tick = expire_tick
+        self._slot = None
+        self._wheel = wheel
+
+    def when(self) -> float:
+        return self._when
+
+    def cancel(self):
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            self._wheel.num_timers -= 1
+        super().cancel()
+
+
+class TimingWheel:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tick: float = 0.001, slot_bits: int = 8, num_levels: int = 4):
+        self.loop = loop
+        self.tick = tick
+        self.slot_bits = slot_bits
+        self.num_slots = 1 << slot_bits
+        self.slot_mask = self.num_slots - 1
+        self.levels = [[set() for _ in range(self.num_slots)] for _ in range(num_levels)]
+        # The furthest a timer can be scheduled ahead. Anything later is parked at the far edge & cascaded down.
+        self.max_ticks_ahead = (1 << (slot_bits * num_levels)) - 1
+        self.start_time = loop.time()
+        self.current_tick = 0
+        self.num_timers = 0
+        self._driver = None
+        self._driver_tick = None
+
+    def _tick_for_time(self, when: float) -> int:
+        return math.ceil((when - self.start_time) / self.tick)
+
+    def call_later(self, delay: float, callback, *args, context=None) -> WheelTimerHandle:
+        return self.call_at(self.loop.time() + delay, callback, *args, context=context)
+
+    def call_at(self, when: float, callback, *args, context=None) -> WheelTimerHandle:
+        expire_tick = max(self._tick_for_time(when), self.current_tick + 1)
+        handle = WheelTimerHandle(when, expire_tick, self, callback, args, context)
+        self._insert(handle)
+        self.num_timers += 1
+        self._ensure_driver(expire_tick)
+        return handle
+
+    def _insert(self, handle: WheelTimerHandle):
+        # Cascaded timers can be due on the very tick that's being processed, i.e. 0 ticks ahead.
+        ticks_ahead = min(max(handle._expire_tick - self.current_tick, 0), self.max_ticks_ahead)
+        level = (max(ticks_ahead, 1).bit_length() - 1) // self.slot_bits
+        slot_idx = ((self.current_tick + ticks_ahead) >> (self.slot_bits * level)) & self.slot_mask
+        slot = self.levels[level][slot_idx]
+        slot.add(handle)
+        handle._slot = slot
+
+    def _ensure_driver(self, expire_tick: int):
+        # Only ever keep one loop timer, armed for the soonest tick we know needs attention.
+        if self._driver is not None and self._driver_tick <= expire_tick:
+            return
+        wake_tick = min(expire_tick, self._next_cascade_tick())
+        if self._driver is not None:
+            if self._driver_tick <= wake_tick:
+                return
+            self._driver.cancel()
+        self._driver_tick = wake_tick
+        self._driver = self.loop.call_at(self.start_time + wake_tick * self.tick, self._advance)
+
+    def _next_cascade_tick(self) -> int:
+        return (self.current_tick | self.slot_mask) + 1
+
+    def _next_wake_tick(self) -> int:
+        # Look for the next non-empty level-0 slot before this level-0 turn ends. That's at
+        # most num_slots set checks. Past that, we need to wake up to cascade regardless.
+        level0 = self.levels[0]
+        cascade_tick = self._next_cascade_tick()
+        for tick in range(self.current_tick + 1, cascade_tick):
+            if level0[tick & self.slot_mask]:
+                return tick
+        return cascade_tick
+
+    def _cascade(self):
+        # Empty the slot of each level above that's just come due, highest level first.
+        levels_to_cascade = []
+        for level in range(1, len(self.levels)):
+            levels_to_cascade.append(level)
+            if (self.current_tick >> (self.slot_bits * level)) & self.slot_mask != 0:
+                break
+        for level in reversed(levels_to_cascade):
+            slot_idx = (self.current_tick >> (self.slot_bits * level)) & self.slot_mask
+            slot = self.levels[level][slot_idx]
+            self.levels[level][slot_idx] = set()
+            for handle in slot:
+                self._insert(handle)
+
+    def _advance(self):
+        self._driver = None
+        now_tick = math.floor((self.loop.time() - self.start_time) / self.tick)
+        while self.current_tick < now_tick and self.num_timers > 0:
+            self.current_tick += 1
+            if self.current_tick & self.slot_mask == 0:
+                self._cascade()
+            slot_idx = self.current_tick & self.slot_mask
+            expired = self.levels[0][slot_idx]
+            if not expired:
+                continue
+            self.levels[0][slot_idx] = set()
+            self.num_timers -= len(expired)
+            # Detach the whole batch first: a callback may cancel a handle that's due on this same tick.
+            for handle in expired:
+                handle._slot = None
+            for handle in list(expired):
+                if not handle.cancelled():
+                    handle._run()
+        if self.num_timers == 0:
+            # Jump straight to now; there's nothing to expire in between.
+            self.current_tick = max(self.current_tick, now_tick)
+            return
+        self._ensure_driver(self._next_wake_tick())
+
+    async def sleep(self, delay: float, result=None):
+        future = self.loop.create_future()
+        handle = self.call_later(delay, _set_result_unless_done, future, result)
+        try:
+            return await future
+        finally:
+            handle.cancel()
+
+
+def _set_result_unless_done(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+async def run_benchmark(name: str, call_later, num_pending, num_timers: int, cancel_fraction: float, max_delay: float):
+    fired = 0
+
+    def on_timeout():
+        nonlocal fired
+        fired += 1
+
+    delays = [random.random() * max_delay for _ in range(num_timers)]
+
+    start_time = time.perf_counter()
+    handles = [call_later(delay, on_timeout) for delay in delays]
+    schedule_time = time.perf_counter() - start_time
+
+    num_cancelled = int(num_timers * cancel_fraction)
+    start_time = time.perf_counter()
+    for handle in handles[:num_cancelled]:
+        handle.cancel()
+    cancel_time = time.perf_counter() - start_time
+    del handles
+    # The heap keeps cancelled handles around until they reach the top or the heap gets rebuilt.
+    still_held = num_pending()
+
+    start_time = time.perf_counter()
+    while fired < num_timers - num_cancelled:
+        await asyncio.sleep(max_delay / 20)
+    drain_time = time.perf_counter() - start_time
+
+    print(
+        f"{name:>6}: schedule {schedule_time:.2f}s ({schedule_time / num_timers * 1e9:.0f}ns/timer), "
+        f"cancel {cancel_time:.2f}s ({cancel_time / num_cancelled * 1e9:.0f}ns/timer), "
+        f"{still_held:,} handles still held after cancelling, "
+        f"then {drain_time:.2f}s until the rest had fired."
+    )
+
+
+async def check_cancel_from_callback():
+    """A callback cancelling a timer due on the same tick: that timer mustn't run, and the wheel must keep going."""
+    loop = asyncio.get_running_loop()
+    wheel = TimingWheel(loop, tick=0.001)
+    fired = []
+    when = loop.time() + 0.005
+    handles = [wheel.call_at(when, fired.append, idx) for idx in range(2)]
+    for idx in range(2):
+        # Whichever of the two runs first cancels the other.
+        handles[idx]._callback = lambda idx=idx: (fired.append(idx), handles[1 - idx].cancel())
+    await wheel.sleep(0.02)
+    assert len(fired) == 1 and wheel.num_timers == 0, (fired, wheel.num_timers)
+
+
+async def main(num_timers: int):
+    loop = asyncio.get_running_loop()
+    await check_cancel_from_callback()
+    # Like per-connection timeouts: most get cancelled because the response came back in time.
+    settings = dict(num_timers=num_timers, cancel_fraction=0.9, max_delay=2.0)
+    print(f"{num_timers:,} timers with delays uniform in [0, {settings['max_delay']}s), {settings['cancel_fraction']:.0%} cancelled.")
+
+    random.seed(0)
+    await run_benchmark("heap", loop.call_later, lambda: len(loop._scheduled), **settings)
+
+    random.seed(0)
+    wheel = TimingWheel(loop, tick=0.001)
+    await run_benchmark("wheel", wheel.call_later, lambda: wheel.num_timers, **settings)
+
+
+if __name__ == "__main__":
+    num_timers = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+    asyncio.run(main(num_timers))
@@ -0,0 +1,178 @@
+"""
+An event-loop that runs on a virtual clock.
+
+Plenty of asyncio code spends nearly all its wall-time asleep: basics.async_solve
+sleeps 0.2s per call, the countdown rockets sleep a second per tick, and so on.
+Tests for code like that spend minutes of real time waiting around for nothing.
+
+VirtualTimeEventLoop keeps its own clock. loop.time() (which asyncio.sleep,
+call_later, call_at & wait_for all go through) reads that clock. When the loop runs
+out of ready work and would otherwise block in selector.select(timeout) until the
+next timer is due, it polls the selector without blocking instead. If no I/O is ready,
+it moves the clock forward by `timeout` and carries on. So time only advances while
+every task is idle, and it advances straight to the next thing that's going to happen.
+
+Given a seed, the loop also shuffles the order in which ready handles run each
+iteration (using its own random.Random(seed)). The same seed always gives the same
+interleaving, so a test can sweep a handful of seeds to shake out ordering bugs
+and reproduce any failure exactly. Without a seed, the order is the usual FIFO.
+
+On a virtual clock, many timers come due at exactly the same instant (100 tasks that
+each sleep(0.2) all wake at 0.2). The loop's timer heap only compares due-times, so it
+would release those in whatever order the heap happens to leave them in. Here, timers
+due at the same time fire in the order they were scheduled, so "FIFO" holds for them
+as well.
+
+Some caveats:
+    - Real I/O (sockets, threads via call_soon_threadsafe, run_in_executor) still
+      takes real time, but the clock doesn't wait for it. While the loop waits on
+      real I/O and nothing else is ready, it jumps straight to the next timer. So a
+      timeout around real I/O, e.g. wait_for(loop.sock_recv(...), 5), fires right
+      away, long before the I/O had a real chance to finish.
+    - Code that polls time.time() or time.monotonic() itself, rather than going
+      through the loop, never sees virtual time. hypotheses/7-custom-async-sleep.py
+      is an example: its watcher task is always ready, so the loop is never idle.
+      Write such code against loop.time() instead.
+    - For SleepingLoop from snarky-ca/countdown.py, see snarky-ca/virtual_countdown.py.
+"""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import time
+
+
+class _ShuffledReadyQueue(collections.deque):
+    """Stands in for the deque at loop._ready, but pops a (seeded) random handle."""
+
+    def __init__(self, rng: random.Random):
+        super().__init__()
+        self.rng = rng
+
+    def popleft(self):
+        idx = self.rng.randrange(len(self))
+        self.rotate(-idx)
+        handle = super().popleft()
+        self.rotate(idx)
+        return handle
+
+
+class _SequencedTimerHandle(asyncio.TimerHandle):
+    """A TimerHandle that breaks ties between equal due-times by scheduling order."""
+    __slots__ = ("_sequence",)
+
+    def __init__(self, sequence: int, when, callback, args, loop, context=None):
+        super().__init__(when, callback, args, loop, context)
+        self._sequence = sequence
+
+    def __lt__(self, other):
+        if self._when != other._when:
+            return self._when < other._when
+        return self._sequence < getattr(other, "_sequence", 0)
+
+    def __le__(self, other):
+        return not other < self
+
+    def __gt__(self, other):
+        return other < self
+
+    def __ge__(self, other):
+        return not self < other
+
+
+class _VirtualTimeSelector:
+
+    def __init__(self, selector, loop: "VirtualTimeEventLoop"):
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout=None):
+        ready = self._selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            # No timers at all. Only real I/O can wake us, so genuinely wait for it.
+            return self._selector.select(None)
+        self._loop.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, seed: int = None, start_time: float = 0.0):
+        super().__init__()
+        self._virtual_time = start_time
+        self._selector = _VirtualTimeSelector(self._selector, self)
+        if seed is not None:
+            self._ready = _ShuffledReadyQueue(random.Random(seed))
+        self._timer_sequence = itertools.count()
+
+    def call_at(self, when, callback, *args, context=None):
+        # BaseEventLoop.call_at, but with a _SequencedTimerHandle. It has to be pushed onto the
+        # heap as one: re-classing a TimerHandle already in the heap could break the heap's order.
+        if when is None:
+            raise TypeError("when cannot be None")
+        self._check_closed()
+        if self._debug:
+            self._check_thread()
+            self._check_callback(callback, "call_at")
+        timer = _SequencedTimerHandle(next(self._timer_sequence), when, callback, args, self, context)
+        if timer._source_traceback:
+            del timer._source_traceback[-1]
+        heapq.heappush(self._scheduled, timer)
+        timer._scheduled = True
+        return timer
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        self._virtual_time += seconds
+
+
+def run(main, *, seed: int = None):
+    """Like asyncio.run(main), but on a VirtualTimeEventLoop."""
+    loop = VirtualTimeEventLoop(seed=seed)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def async_solve(x: int, order: list[int]) -> int:
+    # Like basics.async_solve, which sleeps 0.2 seconds per call.
+    await asyncio.sleep(0.2)
+    order.append(x)
+    return x * 3
+
+
+async def main() -> tuple[float, list[int]]:
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    order = []
+    # 5 rounds of 100 concurrent solves; then one that times out after a long wait.
+    for _ in range(5):
+        await asyncio.gather(*(async_solve(x, order) for x in range(100)))
+    try:
+        await asyncio.wait_for(asyncio.sleep(3600), timeout=60)
+    except asyncio.TimeoutError:
+        pass
+    return loop.time() - start_time, order[:8]
+
+
+if __name__ == "__main__":
+    for seed in (None, 1, 2, 1):
+        start_time = time.perf_counter()
+        virtual_elapsed, first_finishers = run(main(), seed=seed)
+        real_elapsed = time.perf_counter() - start_time
+        print(
+            f"seed={seed}: {virtual_elapsed:.1f}s of virtual time took {real_elapsed * 1e3:.0f}ms of real time. "
+            f"First solves to finish: {first_finishers}."
+        )